@@ -1,15 +1,184 @@
 import os
 import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from fastapi import Request
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy import text, event, exc
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+ALEMBIC_CONFIG = os.path.join(os.path.dirname(__file__), "alembic.ini")
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://postgres:postgres@db:5432/challenger_db")
 
+# Профиль движка задаётся окружением
+DB_ECHO = os.getenv("DB_ECHO", "0").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+# Реплика для чтения и окно, в течение которого после записи пользователь читает из primary
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+READ_REPLICA_RETRY_SECONDS = float(os.getenv("READ_REPLICA_RETRY_SECONDS", "30"))
+# Запросы дольше порога пишутся в лог; 0 — не логировать
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """Время ожидания соединения из пула и его заполненность"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self, pool) -> dict:
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+pool_metrics = PoolMetrics()
+read_pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий время выдачи соединения (ожидание в очереди, создание, pre-ping)"""
+
+    metrics = pool_metrics
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record(time.perf_counter() - started)
+
+
+class ReadInstrumentedPool(InstrumentedPool):
+    metrics = read_pool_metrics
+
+
+def _engine_url(url: str):
+    url = make_url(url)
+    if url.drivername == "postgresql+asyncpg":
+        # Кэш подготовленных выражений на соединение в адаптере SQLAlchemy
+        url = url.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+    return url
+
+
+def _create_engine(url: str, poolclass):
+    engine = create_async_engine(
+        _engine_url(url),
+        echo=DB_ECHO,
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if DB_SLOW_QUERY_MS > 0:
+        event.listen(engine.sync_engine, "before_cursor_execute", _start_query_timer)
+        event.listen(engine.sync_engine, "after_cursor_execute", _log_slow_query)
+        event.listen(engine.sync_engine, "handle_error", _drop_query_timer)
+    return engine
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+    if elapsed_ms >= DB_SLOW_QUERY_MS:
+        logger.warning(f"Slow query ({elapsed_ms:.0f} ms): {' '.join(statement.split())[:1000]}")
+
+
+def _drop_query_timer(context):
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+class RecentWrites:
+    """Ключи (пользователь, челлендж), по которым недавно была запись.
+
+    Пока окно READ_YOUR_WRITES_SECONDS не истекло, чтения по этим ключам идут
+    в primary, чтобы не увидеть отстающую реплику. Записи пользователей (отчёты,
+    вступление) помечают только пользователя: его последующие запросы несут
+    user_id. Челлендж помечается лишь при изменении самого челленджа и его
+    мероприятий, иначе в часы пик горячие челленджи читались бы только из primary.
+    Хранится в памяти процесса.
+    """
+
+    def __init__(self, window: float = READ_YOUR_WRITES_SECONDS, maxsize: int = 100000):
+        self.window = window
+        self.maxsize = maxsize
+        self._expires: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+
+    def mark(self, user_id: Optional[int] = None, challenge_id: Optional[int] = None):
+        expires_at = time.monotonic() + self.window
+        for key in (("user", user_id), ("challenge", challenge_id)):
+            if key[1] is None:
+                continue
+            self._expires[key] = expires_at
+            self._expires.move_to_end(key)
+        while len(self._expires) > self.maxsize:
+            self._expires.popitem(last=False)
+
+    def is_recent(self, user_id: Optional[int] = None, challenge_id: Optional[int] = None) -> bool:
+        now = time.monotonic()
+        for key in (("user", user_id), ("challenge", challenge_id)):
+            expires_at = self._expires.get(key)
+            if expires_at is None:
+                continue
+            if expires_at > now:
+                return True
+            del self._expires[key]
+        return False
+
+
 Base = declarative_base()
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+engine = _create_engine(SQLALCHEMY_DATABASE_URL, InstrumentedPool)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Реплика для чтения; без READ_DATABASE_URL все чтения идут в primary
+read_engine = _create_engine(READ_DATABASE_URL, ReadInstrumentedPool) if READ_DATABASE_URL else None
+AsyncReadSessionLocal = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False) if read_engine else None
+
+recent_writes = RecentWrites()
+# После ошибки подключения к реплике чтения какое-то время идут в primary
+_replica_down_until = 0.0
+
 async def init_db():
     try:
         async with engine.begin() as conn:
@@ -25,9 +194,63 @@ async def init_db():
                 if i == 4:
                     raise e
 
+async def check_schema_version():
+    """Проверяет, что схема БД обновлена до последней миграции.
+
+    Схема создаётся и обновляется только командой alembic upgrade head,
+    при старте backend лишь сверяет версию.
+    """
+    heads = set(ScriptDirectory.from_config(Config(ALEMBIC_CONFIG)).get_heads())
+    async with engine.connect() as conn:
+        current = await conn.run_sync(
+            lambda sync_conn: set(MigrationContext.configure(sync_conn).get_current_heads())
+        )
+    if current != heads:
+        raise RuntimeError(
+            f"Database schema version {sorted(current) or 'none'} does not match {sorted(heads)}; "
+            f"run 'alembic -c backend/alembic.ini upgrade head'"
+        )
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         try:
             yield session
         finally:
             await session.close()
+
+async def get_read_db(request: Request):
+    """Сессия для только читающих обработчиков.
+
+    Идёт в реплику, если она настроена, доступна и по user_id/challenge_id
+    запроса не было недавней записи; иначе — в primary.
+    """
+    global _replica_down_until
+    if AsyncReadSessionLocal is None or time.monotonic() < _replica_down_until or recent_writes.is_recent(
+        _int_param(request, "user_id"), _int_param(request, "challenge_id")
+    ):
+        async for session in get_db():
+            yield session
+        return
+
+    async with AsyncReadSessionLocal() as session:
+        try:
+            await session.connection()
+        except (OSError, asyncio.TimeoutError, exc.DBAPIError, exc.TimeoutError) as e:
+            logger.warning(f"Read replica unavailable, using primary for {READ_REPLICA_RETRY_SECONDS:.0f}s: {e}")
+            _replica_down_until = time.monotonic() + READ_REPLICA_RETRY_SECONDS
+            session = None
+        if session is not None:
+            try:
+                yield session
+            finally:
+                await session.close()
+            return
+    async for session in get_db():
+        yield session
+
+def _int_param(request: Request, name: str) -> Optional[int]:
+    value = request.path_params.get(name, request.query_params.get(name))
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
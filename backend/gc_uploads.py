@@ -0,0 +1,202 @@
+"""Сборка мусора в каталоге фото отчётов.
+
+    python -m backend.gc_uploads          # только отчёт
+    python -m backend.gc_uploads --apply  # удалить файлы-сироты
+
+Находит файлы, на которые не ссылается ни одна строка report_photos (вместе с
+их уменьшенными копиями и брошенными временными файлами), и строки, чьих файлов
+нет на диске. Строки не удаляются — только попадают в отчёт. В конце выводится
+объём фото по челленджам.
+
+Фото отклонённых отчётов не удаляются: строки report_photos у таких отчётов остаются.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+
+from .database import AsyncSessionLocal, engine
+from .models import ReportPhoto
+from .repository import ReportRepository
+from .storage import REPORT_UPLOAD_DIR, REPORT_URL_PREFIX, TMP_DIR, has_lease
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# Файл пишется на диск раньше, чем появляется строка в БД: свежие файлы не трогаем
+MIN_AGE_SECONDS = 3600
+
+# <sha256>.<ext> или уменьшенная копия <sha256>_<size>.webp
+CONTENT_FILE_RE = re.compile(r"^([0-9a-f]{64})(?:_\d+)?\.\w+$")
+
+
+def walk_files(root: str) -> Iterator[Tuple[str, os.stat_result]]:
+    """Обходит каталог без построения полного списка файлов; пути относительно root"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield os.path.relpath(entry.path, root), entry.stat(follow_symlinks=False)
+
+
+def next_batch(files: Iterator, size: int) -> List:
+    batch = []
+    for item in files:
+        batch.append(item)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def remove_orphan(root: str, path: str, content_hash: Optional[str]) -> bool:
+    """Удаляет файл-сироту, если загрузка не взяла аренду на его хеш.
+
+    Файл сначала переносится во временный каталог и только потом проверяется
+    аренда: загрузка, взявшая её позже, уже не найдёт файл и запишет его заново,
+    а взявшая раньше вернёт его на место.
+    """
+    full_path = os.path.join(root, path)
+    if content_hash is None:
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            return False
+        return True
+    os.makedirs(os.path.join(root, TMP_DIR), exist_ok=True)
+    trash_path = os.path.join(root, TMP_DIR, f"{uuid.uuid4().hex}.tmp")
+    try:
+        os.replace(full_path, trash_path)
+    except FileNotFoundError:
+        return False
+    if has_lease(root, content_hash):
+        os.replace(trash_path, full_path)
+        return False
+    os.remove(trash_path)
+    return True
+
+
+async def find_orphans(db, root: str, min_age: float, batch_size: int):
+    """Файлы без ссылок из report_photos, пачками по batch_size"""
+    files = walk_files(root)
+    deadline = time.time() - min_age
+    while True:
+        batch = await asyncio.to_thread(next_batch, files, batch_size)
+        if not batch:
+            break
+        candidates = []
+        for path, file_stat in batch:
+            if file_stat.st_mtime > deadline:
+                continue
+            name = os.path.basename(path)
+            if path.split(os.sep, 1)[0] == TMP_DIR or name.endswith(".tmp"):
+                # Брошенный временный файл прерванной записи или истёкшая аренда
+                yield path, file_stat.st_size, None
+                continue
+            match = CONTENT_FILE_RE.match(name)
+            candidates.append((path, file_stat.st_size, match.group(1) if match else None))
+        if not candidates:
+            continue
+        hashes = {content_hash for _, _, content_hash in candidates if content_hash}
+        urls = {f"{REPORT_URL_PREFIX}{path}" for path, _, content_hash in candidates if not content_hash}
+        result = await db.execute(
+            select(ReportPhoto.content_hash, ReportPhoto.photo_url)
+            .where(or_(ReportPhoto.content_hash.in_(hashes), ReportPhoto.photo_url.in_(urls)))
+        )
+        rows = result.all()
+        referenced_hashes = {row.content_hash for row in rows}
+        referenced_urls = {row.photo_url for row in rows}
+        for path, size, content_hash in candidates:
+            if content_hash:
+                if content_hash not in referenced_hashes:
+                    yield path, size, content_hash
+            elif f"{REPORT_URL_PREFIX}{path}" not in referenced_urls:
+                yield path, size, None
+
+
+async def find_dangling(db, root: str, batch_size: int):
+    """Строки report_photos, чьих файлов нет на диске"""
+    last_id = 0
+    while True:
+        result = await db.execute(
+            select(ReportPhoto.id, ReportPhoto.report_id, ReportPhoto.photo_url)
+            .where(ReportPhoto.id > last_id)
+            .order_by(ReportPhoto.id)
+            .limit(batch_size)
+        )
+        rows = result.all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        def missing():
+            return [
+                row for row in rows
+                if not os.path.isfile(os.path.join(root, row.photo_url[len(REPORT_URL_PREFIX):]))
+            ]
+
+        for row in await asyncio.to_thread(missing):
+            yield row
+
+
+async def collect_garbage(root: str, apply: bool, min_age: float = MIN_AGE_SECONDS, batch_size: int = BATCH_SIZE):
+    orphans = orphan_bytes = removed = 0
+    async with AsyncSessionLocal() as db:
+        async for path, size, content_hash in find_orphans(db, root, min_age, batch_size):
+            orphans += 1
+            orphan_bytes += size
+            logger.info(f"Orphan: {path} ({format_bytes(size)})")
+            if apply and await asyncio.to_thread(remove_orphan, root, path, content_hash):
+                removed += 1
+        # Сессия только читает: закрываем транзакцию, чтобы не держать снимок на весь обход
+        await db.rollback()
+
+        dangling = 0
+        async for row in find_dangling(db, root, batch_size):
+            dangling += 1
+            logger.info(f"Dangling row: photo {row.id} of report {row.report_id} -> {row.photo_url}")
+        await db.rollback()
+
+        usage = await ReportRepository(db).get_storage_by_challenge()
+
+    action = f"removed {removed}" if apply else "dry run, nothing removed"
+    logger.info(f"Orphaned files: {orphans}, {format_bytes(orphan_bytes)} ({action})")
+    logger.info(f"Dangling rows: {dangling}")
+    logger.info("Storage by challenge:")
+    for row in usage:
+        logger.info(f"  {row.challenge_id} {row.title}: {row.photos} photos, {row.files} files, {format_bytes(row.bytes)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=REPORT_UPLOAD_DIR, help="каталог с фото отчётов")
+    parser.add_argument("--apply", action="store_true", help="удалить файлы-сироты (по умолчанию только отчёт)")
+    parser.add_argument("--min-age", type=float, default=MIN_AGE_SECONDS, help="не трогать файлы моложе, секунд")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    try:
+        await collect_garbage(args.root, args.apply, args.min_age, args.batch_size)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import anyio
+from fastapi import Header, HTTPException, Request, Response
+from pydantic import TypeAdapter
+from starlette.datastructures import UploadFile
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+
+class IdempotencyStore:
+    """Результаты запросов по ключу идемпотентности: LRU с ограничением размера и TTL.
+
+    Вместе с результатом (сериализованным ответом или HTTPException с кодом < 500)
+    хранится отпечаток запроса: повтор ключа с другим телом получает 422.
+    Одновременный повтор с тем же ключом ждёт первый запрос. Состояние живёт
+    в памяти процесса, как и у LeaderboardEngine.
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._results: "OrderedDict[str, Tuple[float, str, Any, Optional[HTTPException]]]" = OrderedDict()
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    def get(self, key: str):
+        item = self._results.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return item
+
+    def set(self, key: str, fingerprint: str, result: Any = None, error: Optional[HTTPException] = None):
+        self._results[key] = (time.monotonic() + self.ttl, fingerprint, result, error)
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    async def run(self, key: str, fingerprint: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Выполняет func один раз на ключ; возвращает (результат, повтор ли это)"""
+        while True:
+            stored = self.get(key)
+            if stored is not None:
+                _, stored_fingerprint, result, error = stored
+                _check_fingerprint(stored_fingerprint, fingerprint)
+                if error is not None:
+                    raise error
+                return result, True
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            # Тот же ключ уже обрабатывается: ждём и отдаём его результат
+            _check_fingerprint(pending[0], fingerprint)
+            await asyncio.shield(pending[1])
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = (fingerprint, future)
+        try:
+            result = await func()
+        except HTTPException as e:
+            if e.status_code < 500:
+                self.set(key, fingerprint, error=e)
+            raise
+        else:
+            self.set(key, fingerprint, result)
+            return result, False
+        finally:
+            del self._pending[key]
+            future.set_result(None)
+
+
+def _check_fingerprint(stored: str, fingerprint: str):
+    if stored != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{IDEMPOTENCY_HEADER} has already been used with a different request"
+        )
+
+
+def _hash_file(digest, file):
+    file.seek(0)
+    while chunk := file.read(FINGERPRINT_CHUNK_SIZE):
+        digest.update(chunk)
+    file.seek(0)
+
+
+@lru_cache(maxsize=None)
+def _response_adapter(response_model) -> TypeAdapter:
+    return TypeAdapter(response_model)
+
+
+idempotency_store = IdempotencyStore()
+
+
+class Idempotency:
+    """Зависимость для POST-обработчиков: повтор с тем же Idempotency-Key не выполняет обработчик заново.
+
+    Ответ сериализуется по response_model маршрута один раз и при повторе
+    отдаётся теми же байтами.
+    """
+
+    def __init__(self, request: Request, key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)):
+        if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Invalid {IDEMPOTENCY_HEADER}")
+        self.key = key
+        self.request = request
+
+    async def run(self, func: Callable[[], Awaitable[Any]]):
+        if self.key is None:
+            return await func()
+        # Ключ действует в пределах одного метода и пути
+        scoped_key = f"{self.request.method} {self.request.url.path} {self.key}"
+        adapter = _response_adapter(self.request.scope["route"].response_model)
+
+        async def execute() -> bytes:
+            result = await func()
+            return adapter.dump_json(adapter.validate_python(result, from_attributes=True))
+
+        content, replayed = await idempotency_store.run(scoped_key, await self._fingerprint(), execute)
+        headers = None
+        if replayed:
+            logger.info(f"Replayed idempotent response for {scoped_key}")
+            headers = {IDEMPOTENCY_REPLAYED_HEADER: "true"}
+        return Response(content, media_type="application/json", headers=headers)
+
+    async def _fingerprint(self) -> str:
+        """SHA-256 от строки запроса и тела; для форм — от полей и содержимого файлов.
+
+        Тело к этому моменту уже прочитано FastAPI и берётся из кэша запроса.
+        """
+        digest = hashlib.sha256(self.request.url.query.encode())
+        content_type = self.request.headers.get("content-type", "")
+        if content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+            form = await self.request.form()
+            for name, value in form.multi_items():
+                digest.update(b"\0" + name.encode() + b"\0")
+                if isinstance(value, UploadFile):
+                    digest.update((value.filename or "").encode() + b"\0")
+                    await anyio.to_thread.run_sync(_hash_file, digest, value.file)
+                else:
+                    digest.update(value.encode())
+        else:
+            digest.update(await self.request.body())
+        return digest.hexdigest()
@@ -0,0 +1,166 @@
+"""Уменьшенные копии фото отчётов (превью для списков и модерации).
+
+Копии строятся в пуле процессов, чтобы декодирование и ресайз не блокировали
+event loop, и лежат рядом с оригиналом: ab/cd/<sha256>_<size>.webp.
+
+Для уже загруженных фото копии можно построить командой:
+
+    python -m backend.images
+"""
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from PIL import Image, ImageOps
+
+from .storage import REPORT_UPLOAD_DIR, TMP_DIR
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {"thumb": 128, "preview": 512}
+VARIANT_EXTENSION = ".webp"
+VARIANT_QUALITY = 80
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+
+def variant_path(path: str, size: int) -> str:
+    base, _ = os.path.splitext(path)
+    return f"{base}_{size}{VARIANT_EXTENSION}"
+
+
+def variant_urls(photo_url: str) -> Dict[str, str]:
+    return {name: variant_path(photo_url, size) for name, size in VARIANT_SIZES.items()}
+
+
+def generate_variants(full_path: str) -> List[str]:
+    """Строит недостающие копии файла. Выполняется в процессе пула."""
+    targets = [(size, variant_path(full_path, size)) for size in VARIANT_SIZES.values()]
+    targets = [(size, target) for size, target in targets if not os.path.exists(target)]
+    if not targets:
+        return []
+    created = []
+    with Image.open(full_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        # От большего размера к меньшему: каждый следующий ресайз работает с уже уменьшенной копией
+        for size, target in sorted(targets, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+            try:
+                image.save(tmp_path, "WEBP", quality=VARIANT_QUALITY)
+                os.replace(tmp_path, target)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            created.append(target)
+    return created
+
+
+def resize_image(full_path: str, target: str, width: Optional[int], height: Optional[int]) -> int:
+    """Вписывает изображение в width x height (без увеличения) и пишет WebP в target.
+
+    Выполняется в процессе пула, возвращает размер результата в байтах.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        with Image.open(full_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+            image.thumbnail((width or image.width, height or image.height), Image.LANCZOS)
+            image.save(tmp_path, "WEBP", quality=VARIANT_QUALITY)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(target)
+
+
+class ImagePipeline:
+    """Фоновая генерация копий фото в ProcessPoolExecutor"""
+
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def shutdown(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, func, *args):
+        """Выполняет func(*args) в пуле процессов и возвращает результат"""
+        if self._executor is None:
+            self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def schedule(self, full_paths: List[str]):
+        """Ставит файлы в очередь на генерацию копий, не дожидаясь результата"""
+        if self._executor is None:
+            self.start()
+        for full_path in dict.fromkeys(full_paths):
+            task = asyncio.create_task(self._generate(full_path))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, full_path: str):
+        try:
+            created = await self.run(generate_variants, full_path)
+            if created:
+                logger.info(f"Generated {len(created)} variants for {full_path}")
+        except Exception as e:
+            logger.warning(f"Failed to generate variants for {full_path}: {e}")
+
+
+image_pipeline = ImagePipeline()
+
+
+def find_originals(root: str) -> List[str]:
+    """Оригиналы в хранилище по хешу: ab/cd/<sha256>.<ext>"""
+    originals = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name != TMP_DIR]
+        for filename in filenames:
+            name, ext = os.path.splitext(filename)
+            if len(name) == 64 and ext != ".tmp":
+                originals.append(os.path.join(directory, filename))
+    return originals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Построить недостающие уменьшенные копии фото отчётов")
+    parser.add_argument("--root", default=REPORT_UPLOAD_DIR, help="каталог с фото отчётов")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS)
+    args = parser.parse_args()
+    originals = find_originals(args.root)
+    created = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(generate_variants, path): path for path in originals}
+        for future, path in futures.items():
+            try:
+                created += len(future.result())
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Failed to generate variants for {path}: {e}")
+    logger.info(f"Checked {len(originals)} photos: {created} variants created, {failed} failed")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
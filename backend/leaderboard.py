@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_CACHE_ENABLED = os.getenv("LEADERBOARD_CACHE", "0").lower() in ("1", "true", "yes")
+
+# Ключ сортировки совпадает с SQL-рейтингом: points DESC, joined_at ASC, id ASC
+RankKey = Tuple[int, datetime, int]
+
+
+class ChallengeRanking:
+    """Рейтинг одного челленджа: отсортированный массив ключей участников.
+
+    Ранг и срезы ищутся бинарным поиском, смена очков — удаление и вставка ключа.
+    """
+
+    def __init__(self):
+        self._keys: List[RankKey] = []
+        self._by_user: Dict[int, RankKey] = {}
+        self._user_by_key: Dict[RankKey, int] = {}
+        self._usernames: Dict[int, Optional[str]] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._by_user
+
+    def set_participant(self, participant_id: int, user_id: int, points: int,
+                        joined_at: Optional[datetime], username: Optional[str] = None):
+        self.remove(user_id)
+        key = (-(points or 0), joined_at or datetime.min, participant_id)
+        insort(self._keys, key)
+        self._by_user[user_id] = key
+        self._user_by_key[key] = user_id
+        self._usernames[user_id] = username
+
+    def set_points(self, user_id: int, points: int):
+        key = self._by_user.get(user_id)
+        if key is None or -key[0] == points:
+            return
+        self.set_participant(key[2], user_id, points, key[1], self._usernames.get(user_id))
+
+    def remove(self, user_id: int):
+        key = self._by_user.pop(user_id, None)
+        if key is None:
+            return
+        del self._keys[bisect_left(self._keys, key)]
+        del self._user_by_key[key]
+        self._usernames.pop(user_id, None)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        key = self._by_user.get(user_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1
+
+    def entry(self, position: int) -> dict:
+        """Участник на позиции position (с нуля) в формате строки рейтинга"""
+        key = self._keys[position]
+        user_id = self._user_by_key[key]
+        return {
+            "rank": position + 1,
+            "user_id": user_id,
+            "username": self._usernames.get(user_id),
+            "points": -key[0],
+            "joined_at": None if key[1] == datetime.min else key[1],
+        }
+
+    def top(self, limit: int) -> List[dict]:
+        return [self.entry(i) for i in range(min(limit, len(self._keys)))]
+
+    def around(self, user_id: int, radius: int) -> List[dict]:
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        end = min(len(self._keys), rank + radius)
+        return [self.entry(i) for i in range(start, end)]
+
+
+class LeaderboardEngine:
+    """Рейтинги челленджей в памяти процесса.
+
+    Рейтинг прогревается из challenge_participants при первом обращении и затем
+    обновляется инкрементально при изменении очков. Состояние живёт в одном
+    процессе, поэтому движок рассчитан на запуск backend в одном воркере.
+    """
+
+    def __init__(self):
+        self._rankings: Dict[int, ChallengeRanking] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # Изменения, пришедшие во время прогрева рейтинга; применяются после него
+        self._pending: Dict[int, List[Callable[[ChallengeRanking], None]]] = {}
+
+    async def get_ranking(self, challenge_id: int, participant_repository) -> ChallengeRanking:
+        ranking = self._rankings.get(challenge_id)
+        if ranking is not None:
+            return ranking
+        lock = self._locks.setdefault(challenge_id, asyncio.Lock())
+        async with lock:
+            ranking = self._rankings.get(challenge_id)
+            if ranking is not None:
+                return ranking
+            self._pending[challenge_id] = []
+            try:
+                rows = await participant_repository.get_ranking_rows(challenge_id)
+                ranking = ChallengeRanking()
+                for row in rows:
+                    ranking.set_participant(row.id, row.user_id, row.points, row.joined_at, row.username)
+                for apply in self._pending[challenge_id]:
+                    apply(ranking)
+            finally:
+                self._pending.pop(challenge_id, None)
+            self._rankings[challenge_id] = ranking
+            logger.info(f"Leaderboard for challenge {challenge_id} warmed: {len(ranking)} participants")
+            return ranking
+
+    def set_points(self, challenge_id: int, user_id: int, points: int):
+        self._apply(challenge_id, lambda ranking: ranking.set_points(user_id, points))
+
+    def add_participant(self, challenge_id: int, participant_id: int, user_id: int, points: int,
+                        joined_at: Optional[datetime], username: Optional[str] = None):
+        self._apply(
+            challenge_id,
+            lambda ranking: ranking.set_participant(participant_id, user_id, points, joined_at, username)
+        )
+
+    def _apply(self, challenge_id: int, change: Callable[[ChallengeRanking], None]):
+        pending = self._pending.get(challenge_id)
+        if pending is not None:
+            pending.append(change)
+        ranking = self._rankings.get(challenge_id)
+        if ranking is not None:
+            change(ranking)
+
+    def invalidate(self, challenge_id: int):
+        self._rankings.pop(challenge_id, None)
+
+
+leaderboard_engine = LeaderboardEngine()
+
+
+def get_leaderboard_engine() -> Optional[LeaderboardEngine]:
+    return leaderboard_engine if LEADERBOARD_CACHE_ENABLED else None
@@ -1,17 +1,27 @@
-from typing import List
+from typing import List, Optional
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Body
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Request, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func
 from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
+import asyncio
 import os
-from datetime import date
+from datetime import date, datetime
 
-from .database import get_db, engine, Base, init_db
+from .database import get_db, get_read_db, engine, read_engine, init_db, check_schema_version, pool_metrics, read_pool_metrics
 from .repository import ChallengeRepository, EventRepository, ChallengeParticipantRepository, ReportRepository
 from .service import ChallengeService, EventService, ChallengeParticipantService, ReportService
-from .schemas import Challenge, ChallengeCreate, ChallengeUpdate, Event, EventCreate, EventUpdate, User, UserCreate, UserUpdate, Report, ReportCreate, ReportPhoto, ReportUpdate
+from .pagination import REPORTS_PAGE_DEFAULT, REPORTS_PAGE_MAX, NEXT_CURSOR_HEADER
+from .leaderboard import get_leaderboard_engine
+from .images import image_pipeline
+from .static import ResizingStaticFiles, ResizeCache
+from .idempotency import Idempotency, IDEMPOTENCY_REPLAYED_HEADER
+from .responses import RowsResponse, rows_response
+from .storage import UploadTooLarge, UPLOAD_MAX_REQUEST_SIZE, UPLOAD_DIR, REPORT_UPLOAD_DIR
+from .schemas import Challenge, ChallengeBrief, ChallengeCreate, ChallengeParticipant, ChallengeUpdate, Event, EventCreate, EventUpdate, User, UserCreate, UserUpdate, Report, ReportCreate, ReportDays, ReportPhoto, ReportUpdate, Leaderboard, ChallengeView, ChallengeStorage
 from . import models
 from .models import User as UserModel
 
@@ -19,15 +29,15 @@ from .models import User as UserModel
 async def lifespan(app: FastAPI):
     # Startup
     await init_db()
-    try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-    except Exception as e:
-        print(f"Error creating tables: {e}")
-        raise
+    await check_schema_version()
+    image_pipeline.start()
+    await asyncio.to_thread(resize_cache.load)
     yield
     # Shutdown
+    await image_pipeline.shutdown()
     await engine.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -38,16 +48,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, IDEMPOTENCY_REPLAYED_HEADER],
 )
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Отклоняет слишком большие загрузки до разбора multipart-тела"""
+    if request.method == "POST" and (request.url.path.endswith("/photos") or request.url.path == "/reports/submit"):
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_REQUEST_SIZE:
+            return JSONResponse(status_code=413, content={"detail": f"Request exceeds {UPLOAD_MAX_REQUEST_SIZE} bytes"})
+    return await call_next(request)
+
 # Монтируем статические файлы
-os.makedirs("uploads/reports", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+os.makedirs(REPORT_UPLOAD_DIR, exist_ok=True)
+resize_cache = ResizeCache()
+app.mount("/uploads", ResizingStaticFiles(directory=UPLOAD_DIR, images=image_pipeline, cache=resize_cache), name="uploads")
 
 # Dependency
 def get_challenge_service(db: AsyncSession = Depends(get_db)) -> ChallengeService:
     repository = ChallengeRepository(db)
-    return ChallengeService(repository)
+    return ChallengeService(repository, leaderboard=get_leaderboard_engine())
 
 def get_event_service(db: AsyncSession = Depends(get_db)) -> EventService:
     repository = EventRepository(db)
@@ -55,11 +76,24 @@ def get_event_service(db: AsyncSession = Depends(get_db)) -> EventService:
 
 def get_participant_service(db: AsyncSession = Depends(get_db)) -> ChallengeParticipantService:
     repository = ChallengeParticipantRepository(db)
-    return ChallengeParticipantService(repository)
+    return ChallengeParticipantService(repository, leaderboard=get_leaderboard_engine())
 
 def get_report_service(db: AsyncSession = Depends(get_db)) -> ReportService:
     repository = ReportRepository(db)
-    return ReportService(repository, upload_dir="/app/uploads/reports")
+    return ReportService(repository, upload_dir=REPORT_UPLOAD_DIR, leaderboard=get_leaderboard_engine(), images=image_pipeline)
+
+# Только читающие обработчики: реплика, если настроена (см. get_read_db)
+def get_challenge_read_service(db: AsyncSession = Depends(get_read_db)) -> ChallengeService:
+    return get_challenge_service(db)
+
+def get_event_read_service(db: AsyncSession = Depends(get_read_db)) -> EventService:
+    return get_event_service(db)
+
+def get_participant_read_service(db: AsyncSession = Depends(get_read_db)) -> ChallengeParticipantService:
+    return get_participant_service(db)
+
+def get_report_read_service(db: AsyncSession = Depends(get_read_db)) -> ReportService:
+    return get_report_service(db)
 
 # Challenge routes
 @app.post("/challenges/", response_model=Challenge)
@@ -78,16 +112,39 @@ async def create_challenge(
     )
 
 @app.get("/challenges/", response_model=List[Challenge])
-async def read_challenges(service: ChallengeService = Depends(get_challenge_service)):
-    return await service.get_all_challenges()
+async def read_challenges(service: ChallengeService = Depends(get_challenge_read_service)):
+    return rows_response(await service.get_all_challenges())
+
+@app.get("/challenges/active", response_model=List[ChallengeBrief])
+async def read_active_challenges(
+    on: Optional[date] = None,
+    limit: int = Query(8, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    service: ChallengeService = Depends(get_challenge_read_service)
+):
+    """Челленджи, активные на дату `on` (по умолчанию сегодня), постранично"""
+    rows = await service.get_active_challenges(on or date.today(), limit, offset)
+    return rows_response([row._asdict() for row in rows])
 
 @app.get("/challenges/{challenge_id}", response_model=Challenge)
-async def read_challenge(challenge_id: int, service: ChallengeService = Depends(get_challenge_service)):
+async def read_challenge(challenge_id: int, service: ChallengeService = Depends(get_challenge_read_service)):
     challenge = await service.get_challenge(challenge_id)
     if challenge is None:
         raise HTTPException(status_code=404, detail="Challenge not found")
     return challenge
 
+@app.get("/bot/challenge-view", response_model=ChallengeView)
+async def read_challenge_view(
+    challenge_id: int,
+    telegram_id: str,
+    service: ChallengeService = Depends(get_challenge_service)
+):
+    """Всё для карточки челленджа в боте за один запрос"""
+    view = await service.get_challenge_view(challenge_id, telegram_id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    return view
+
 @app.patch("/challenges/{challenge_id}", response_model=Challenge)
 async def update_challenge(
     challenge_id: int,
@@ -130,12 +187,12 @@ async def create_event(event: EventCreate, service: EventService = Depends(get_e
 @app.get("/challenges/{challenge_id}/events/", response_model=List[Event])
 async def read_challenge_events(
     challenge_id: int,
-    service: EventService = Depends(get_event_service)
+    service: EventService = Depends(get_event_read_service)
 ):
-    return await service.get_challenge_events(challenge_id)
+    return rows_response(await service.get_challenge_events(challenge_id))
 
 @app.get("/events/{event_id}", response_model=Event)
-async def read_event(event_id: int, service: EventService = Depends(get_event_service)):
+async def read_event(event_id: int, service: EventService = Depends(get_event_read_service)):
     event = await service.get_event(event_id)
     if event is None:
         raise HTTPException(status_code=404, detail="Event not found")
@@ -169,16 +226,21 @@ async def delete_event(event_id: int, service: EventService = Depends(get_event_
 @app.get("/challenges/{challenge_id}/events", response_model=list[Event])
 async def get_challenge_events(
     challenge_id: int,
-    service: EventService = Depends(get_event_service)
+    service: EventService = Depends(get_event_read_service)
 ):
-    return await service.get_challenge_events(challenge_id)
+    return rows_response(await service.get_challenge_events(challenge_id))
 
-@app.post("/challenges/{challenge_id}/join")
-async def join_challenge(challenge_id: int, user_id: int, service: ChallengeParticipantService = Depends(get_participant_service)):
-    return await service.join_challenge(user_id, challenge_id)
+@app.post("/challenges/{challenge_id}/join", response_model=ChallengeParticipant)
+async def join_challenge(
+    challenge_id: int,
+    user_id: int,
+    service: ChallengeParticipantService = Depends(get_participant_service),
+    idempotency: Idempotency = Depends()
+):
+    return await idempotency.run(lambda: service.join_challenge(user_id, challenge_id))
 
 @app.get("/challenges/{challenge_id}/is_joined")
-async def is_joined(challenge_id: int, user_id: int, service: ChallengeParticipantService = Depends(get_participant_service)):
+async def is_joined(challenge_id: int, user_id: int, service: ChallengeParticipantService = Depends(get_participant_read_service)):
     return {"joined": await service.is_joined(user_id, challenge_id)}
 
 @app.get("/users/by_telegram_id/{telegram_id}", response_model=User)
@@ -198,6 +260,24 @@ async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     await db.refresh(user_obj)
     return user_obj
 
+@app.post("/users/upsert", response_model=User)
+async def upsert_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    """Создаёт пользователя или обновляет username существующего за один запрос"""
+    now = datetime.utcnow()
+    stmt = insert(UserModel).values(**user.dict(), created_at=now, updated_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserModel.telegram_id],
+        set_={
+            "username": func.coalesce(stmt.excluded.username, UserModel.username),
+            "phone_number": func.coalesce(stmt.excluded.phone_number, UserModel.phone_number),
+            "updated_at": now
+        }
+    ).returning(UserModel)
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    user_obj = result.scalar_one()
+    await db.commit()
+    return user_obj
+
 @app.patch("/users/{user_id}", response_model=User)
 async def update_user(user_id: int, user: UserUpdate, db: AsyncSession = Depends(get_db)):
     q = select(UserModel).where(UserModel.id == user_id)
@@ -215,18 +295,48 @@ async def update_user(user_id: int, user: UserUpdate, db: AsyncSession = Depends
 @app.post("/reports/", response_model=Report)
 async def create_report(
     report: ReportCreate,
-    service: ReportService = Depends(get_report_service)
+    service: ReportService = Depends(get_report_service),
+    idempotency: Idempotency = Depends()
 ):
-    return await service.create_report(report)
+    return await idempotency.run(lambda: service.create_report(report))
+
+@app.post("/reports/submit", response_model=Report)
+async def submit_report(
+    user_id: int = Form(...),
+    text_content: str = Form(...),
+    report_date: date = Form(...),
+    challenge_id: Optional[int] = Form(None),
+    event_id: Optional[int] = Form(None),
+    photos: List[UploadFile] = File(...),
+    service: ReportService = Depends(get_report_service),
+    idempotency: Idempotency = Depends()
+):
+    """Отчёт вместе с фотографиями одним multipart-запросом и одной транзакцией"""
+    report = ReportCreate(
+        user_id=user_id,
+        text_content=text_content,
+        report_date=report_date,
+        challenge_id=challenge_id,
+        event_id=event_id
+    )
+    try:
+        return await idempotency.run(lambda: service.create_report(report, photos=photos))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/reports/{report_id}/photos", response_model=List[ReportPhoto])
 async def upload_report_photos(
     report_id: int,
     photos: List[UploadFile] = File(...),
-    service: ReportService = Depends(get_report_service)
+    service: ReportService = Depends(get_report_service),
+    idempotency: Idempotency = Depends()
 ):
     try:
-        return await service.upload_photos(report_id, photos)
+        return await idempotency.run(lambda: service.upload_photos(report_id, photos))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -235,55 +345,110 @@ async def upload_report_photos(
 @app.get("/reports/user/{user_id}", response_model=List[Report])
 async def get_user_reports(
     user_id: int,
-    service: ReportService = Depends(get_report_service),
+    cursor: Optional[str] = None,
+    limit: int = Query(REPORTS_PAGE_DEFAULT, ge=1, le=REPORTS_PAGE_MAX),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    service: ReportService = Depends(get_report_read_service),
     request: Request = None
 ):
-    return await service.get_user_reports(user_id, request=request)
+    try:
+        reports, next_cursor = await service.get_user_reports(
+            user_id, request=request, cursor=cursor, limit=limit, date_from=date_from, date_to=date_to
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return rows_response(reports, next_cursor)
+
+@app.get("/reports/user/{user_id}/challenge/{challenge_id}/days", response_model=ReportDays)
+async def get_user_report_days(
+    user_id: int,
+    challenge_id: int,
+    service: ReportService = Depends(get_report_read_service)
+):
+    days = await service.get_report_days(user_id, challenge_id)
+    if days is None:
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    return days
 
 @app.get("/reports/challenge/{challenge_id}", response_model=List[Report])
 async def get_challenge_reports(
     challenge_id: int,
-    service: ReportService = Depends(get_report_service),
+    cursor: Optional[str] = None,
+    limit: int = Query(REPORTS_PAGE_DEFAULT, ge=1, le=REPORTS_PAGE_MAX),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    service: ReportService = Depends(get_report_read_service),
     request: Request = None
 ):
-    return await service.get_challenge_reports(challenge_id, request=request)
+    try:
+        reports, next_cursor = await service.get_challenge_reports(
+            challenge_id, request=request, cursor=cursor, limit=limit, date_from=date_from, date_to=date_to
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return rows_response(reports, next_cursor)
 
 @app.get("/reports/event/{event_id}", response_model=List[Report])
 async def get_event_reports(
     event_id: int,
-    service: ReportService = Depends(get_report_service),
+    cursor: Optional[str] = None,
+    limit: int = Query(REPORTS_PAGE_DEFAULT, ge=1, le=REPORTS_PAGE_MAX),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    service: ReportService = Depends(get_report_read_service),
     request: Request = None
 ):
-    return await service.get_event_reports(event_id)
+    try:
+        reports, next_cursor = await service.get_event_reports(
+            event_id, cursor=cursor, limit=limit, date_from=date_from, date_to=date_to
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return rows_response(reports, next_cursor)
+
+@app.get("/reports/event/{event_id}/user/{user_id}", response_model=Report)
+async def get_user_event_report(
+    event_id: int,
+    user_id: int,
+    service: ReportService = Depends(get_report_read_service)
+):
+    report = await service.get_user_event_report(user_id, event_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return report
 
 @app.get("/challenges/{challenge_id}/participants/{user_id}/points")
-async def get_participant_points(challenge_id: int, user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_participant_points(challenge_id: int, user_id: int, db: AsyncSession = Depends(get_read_db)):
     repo = ChallengeParticipantRepository(db)
     participant = await repo.get_participant(user_id, challenge_id)
     if not participant:
         raise HTTPException(status_code=404, detail="Participant not found")
     return {"points": participant.points}
 
-@app.get("/challenges/{challenge_id}/leaderboard")
-async def get_challenge_leaderboard(challenge_id: int, db: AsyncSession = Depends(get_db)):
-    """Получить рейтинг участников челленджа"""
-    repo = ChallengeParticipantRepository(db)
-    participants = await repo.get_challenge_participants_with_users(challenge_id)
-    
-    # Сортируем по очкам в убывающем порядке
-    leaderboard = []
-    for participant in participants:
-        leaderboard.append({
-            "user_id": participant.user_id,
-            "username": participant.user.username or "Аноним",
-            "points": participant.points,
-            "joined_at": participant.joined_at
-        })
-    
-    # Сортируем по очкам (по убыванию) и дате присоединения (по возрастанию)
-    leaderboard.sort(key=lambda x: (-x["points"], x["joined_at"]))
-    
-    return leaderboard
+@app.get("/challenges/{challenge_id}/leaderboard", response_model=Leaderboard)
+async def get_challenge_leaderboard(
+    challenge_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    user_id: Optional[int] = None,
+    around: int = Query(0, ge=0, le=50),
+    service: ChallengeParticipantService = Depends(get_participant_read_service)
+):
+    """Топ участников челленджа, позиция пользователя user_id (и ±around соседей) и общее число участников"""
+    return RowsResponse(await service.get_leaderboard(challenge_id, limit, user_id, around))
+
+@app.get("/metrics/db")
+async def get_db_metrics():
+    """Заполненность пула соединений и время ожидания соединения"""
+    return {
+        "primary": pool_metrics.snapshot(engine.pool),
+        "replica": read_pool_metrics.snapshot(read_engine.pool) if read_engine is not None else None,
+    }
+
+@app.get("/storage/challenges", response_model=List[ChallengeStorage])
+async def get_storage_by_challenge(service: ReportService = Depends(get_report_read_service)):
+    """Объём фото отчётов по челленджам"""
+    return await service.get_storage_by_challenge()
 
 @app.delete("/reports/{report_id}")
 async def delete_report(
@@ -0,0 +1,130 @@
+"""Перенос фото отчётов из плоского каталога в хранилище с адресацией по содержимому.
+
+    python -m backend.migrate_photo_storage          # показать, что будет сделано
+    python -m backend.migrate_photo_storage --apply  # перенести файлы и обновить строки
+
+Файлы с одинаковым содержимым сливаются в один, строки report_photos получают
+content_hash и size_bytes. Старые файлы удаляются после коммита всех строк;
+повторный запуск обрабатывает только строки без хеша.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+from sqlalchemy import select
+
+from .database import AsyncSessionLocal, engine
+from .models import ReportPhoto
+from .storage import REPORT_UPLOAD_DIR, REPORT_URL_PREFIX, UPLOAD_CHUNK_SIZE, content_path, file_extension
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def hash_file(path: str):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def place_in_store(root: str, old_path: str, content_hash: str):
+    """Кладёт копию файла в хранилище (жёсткой ссылкой или копированием); старый файл не трогает"""
+    path = content_path(content_hash, file_extension(old_path))
+    full_path = os.path.join(root, path)
+    if os.path.exists(full_path):
+        return path
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    try:
+        os.link(old_path, full_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(old_path, tmp_path)
+        os.replace(tmp_path, full_path)
+    return path
+
+
+def remove_old_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def migrate(root: str, apply: bool):
+    migrated = missing = 0
+    # Несколько строк могут ссылаться на один старый файл
+    moved = {}
+    last_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(ReportPhoto)
+                .where(ReportPhoto.content_hash.is_(None), ReportPhoto.id > last_id)
+                .order_by(ReportPhoto.id)
+                .limit(BATCH_SIZE)
+            )
+            photos = result.scalars().all()
+            if not photos:
+                break
+            last_id = photos[-1].id
+            for photo in photos:
+                name = photo.photo_url[len(REPORT_URL_PREFIX):] if photo.photo_url.startswith(REPORT_URL_PREFIX) else photo.photo_url
+                old_path = os.path.join(root, name)
+                if old_path in moved:
+                    path, content_hash, size = moved[old_path]
+                elif os.path.isfile(old_path):
+                    content_hash, size = await asyncio.to_thread(hash_file, old_path)
+                    path = content_path(content_hash, file_extension(old_path))
+                    if apply:
+                        path = await asyncio.to_thread(place_in_store, root, old_path, content_hash)
+                    moved[old_path] = (path, content_hash, size)
+                else:
+                    logger.warning(f"Photo {photo.id}: file {old_path} not found")
+                    missing += 1
+                    continue
+                logger.info(f"Photo {photo.id}: {photo.photo_url} -> {REPORT_URL_PREFIX}{path}")
+                if apply:
+                    photo.photo_url = f"{REPORT_URL_PREFIX}{path}"
+                    photo.content_hash = content_hash
+                    photo.size_bytes = size
+                migrated += 1
+            if apply:
+                await db.commit()
+    # Старые файлы удаляются только после коммита всех строк: на один файл могут ссылаться
+    # строки из разных пачек, а при сбое раньше строки должны остаться со своими файлами
+    if apply:
+        stale = [
+            old_path for old_path, (path, _, _) in moved.items()
+            if os.path.normpath(old_path) != os.path.normpath(os.path.join(root, path))
+        ]
+        await asyncio.to_thread(remove_old_files, stale)
+    unique = len({content_hash for _, content_hash, _ in moved.values()})
+    logger.info(f"{'Migrated' if apply else 'Would migrate'} {migrated} photos into {unique} files, {missing} files missing")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=REPORT_UPLOAD_DIR, help="каталог с фото отчётов")
+    parser.add_argument("--apply", action="store_true", help="выполнить перенос (по умолчанию только отчёт)")
+    args = parser.parse_args()
+    try:
+        await migrate(args.root, args.apply)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""initial schema
+
+Таблицы в том виде, в каком их создавал Base.metadata.create_all при старте
+backend до перехода на миграции. В базе, созданной тем способом, уже
+существующие таблицы пропускаются, так что upgrade head подходит и для неё.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # В offline-режиме (--sql) подключения нет: печатаем создание всех таблиц
+    existing = set() if op.get_context().as_sql else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("telegram_id", sa.String(length=255), nullable=True),
+            sa.Column("username", sa.String(length=255), nullable=True),
+            sa.Column("first_name", sa.String(length=255), nullable=True),
+            sa.Column("last_name", sa.String(length=255), nullable=True),
+            sa.Column("phone_number", sa.String(length=20), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_telegram_id", "users", ["telegram_id"], unique=True)
+
+    if "challenges" not in existing:
+        op.create_table(
+            "challenges",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("title", sa.String(length=255), nullable=False),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("start_date", sa.DateTime(), nullable=False),
+            sa.Column("end_date", sa.DateTime(), nullable=False),
+            sa.Column("requires_phone", sa.Boolean(), nullable=True),
+            sa.Column("points_per_report", sa.Integer(), nullable=True),
+            sa.Column("required_photos", sa.Integer(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_challenges_id", "challenges", ["id"])
+
+    if "events" not in existing:
+        op.create_table(
+            "events",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=False),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("description", sa.String(), nullable=False),
+            sa.Column("date", sa.DateTime(), nullable=False),
+            sa.Column("points_per_report", sa.Integer(), nullable=False),
+            sa.Column("required_photos", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["challenge_id"], ["challenges.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+
+    if "challenge_participants" not in existing:
+        op.create_table(
+            "challenge_participants",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=False),
+            sa.Column("joined_at", sa.DateTime(), nullable=True),
+            sa.Column("points", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["challenge_id"], ["challenges.id"], ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_challenge_participants_id", "challenge_participants", ["id"])
+
+    if "user_reports" not in existing:
+        op.create_table(
+            "user_reports",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=True),
+            sa.Column("event_id", sa.Integer(), nullable=True),
+            sa.Column("text_content", sa.Text(), nullable=False),
+            sa.Column("report_date", sa.Date(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=True),
+            sa.Column("rejected", sa.Boolean(), nullable=True),
+            sa.Column("rejected_at", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["challenge_id"], ["challenges.id"], ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["event_id"], ["events.id"], ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_user_reports_id", "user_reports", ["id"])
+
+    if "report_photos" not in existing:
+        op.create_table(
+            "report_photos",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("report_id", sa.Integer(), nullable=False),
+            sa.Column("photo_url", sa.String(length=255), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["report_id"], ["user_reports.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_report_photos_id", "report_photos", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("report_photos")
+    op.drop_table("user_reports")
+    op.drop_table("challenge_participants")
+    op.drop_table("events")
+    op.drop_table("challenges")
+    op.drop_table("users")
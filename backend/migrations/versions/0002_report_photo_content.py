@@ -0,0 +1,32 @@
+"""report photo content hash and size
+
+Хеш SHA-256 и размер файла фото; число строк с одним хешем — счётчик ссылок
+на файл. Существующие файлы переносятся командой
+python -m backend.migrate_photo_storage --apply.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE report_photos ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+    op.execute("ALTER TABLE report_photos ADD COLUMN IF NOT EXISTS size_bytes INTEGER")
+
+
+def downgrade() -> None:
+    op.drop_column("report_photos", "size_bytes")
+    op.drop_column("report_photos", "content_hash")
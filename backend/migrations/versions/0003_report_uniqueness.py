@@ -0,0 +1,141 @@
+"""report and participant uniqueness
+
+Один ежедневный отчёт на день челленджа, один отчёт на мероприятие и одна
+запись участника на пользователя и челлендж. Перед созданием индексов
+накопившиеся дубликаты удаляются (остаётся самая ранняя запись), а баллы,
+начисленные за удалённые отчёты, списываются с участника.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (уникальный индекс, определение, обычный индекс, который он заменяет)
+UNIQUE_INDEXES = [
+    (
+        "uq_user_reports_daily",
+        "user_reports (user_id, challenge_id, report_date) WHERE event_id IS NULL",
+        "ix_user_reports_daily",
+    ),
+    ("uq_user_reports_user_event", "user_reports (user_id, event_id)", "ix_user_reports_user_event"),
+]
+
+
+def _drop_invalid_index(name: str) -> None:
+    # Недостроенный после сбоя CONCURRENTLY индекс остаётся INVALID и не проверяет уникальность:
+    # удаляем его, чтобы CREATE ... IF NOT EXISTS построил индекс заново
+    op.execute(f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = '{name}' AND NOT i.indisvalid
+            ) THEN
+                EXECUTE 'DROP INDEX {name}';
+            END IF;
+        END $$
+    """)
+
+
+def _index_is_valid(name: str) -> bool:
+    if op.get_context().as_sql:
+        return True
+    return bool(op.get_bind().execute(
+        sa.text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"
+        ),
+        {"name": name}
+    ).scalar())
+
+
+def upgrade() -> None:
+    # Сначала сливаем дубликаты участников, чтобы списание баллов ниже попало в оставшуюся запись
+    op.execute("""
+        UPDATE challenge_participants p
+        SET points = dup.points
+        FROM (
+            SELECT MIN(id) AS id, MAX(points) AS points
+            FROM challenge_participants
+            GROUP BY user_id, challenge_id
+            HAVING COUNT(*) > 1
+        ) dup
+        WHERE p.id = dup.id
+    """)
+    op.execute("""
+        DELETE FROM challenge_participants p
+        USING challenge_participants d
+        WHERE p.user_id = d.user_id
+          AND p.challenge_id = d.challenge_id
+          AND p.id > d.id
+    """)
+    # Удаляем дубликаты отчётов и списываем начисленные за них баллы
+    # (за отклонённые баллы уже списаны при отклонении)
+    op.execute("""
+        WITH deleted AS (
+            DELETE FROM user_reports r
+            WHERE EXISTS (
+                SELECT 1 FROM user_reports d
+                WHERE d.user_id = r.user_id
+                  AND d.id < r.id
+                  AND (
+                      (r.event_id IS NULL AND d.event_id IS NULL
+                       AND d.challenge_id = r.challenge_id AND d.report_date = r.report_date)
+                      OR (r.event_id IS NOT NULL AND d.event_id = r.event_id)
+                  )
+            )
+            RETURNING r.user_id, r.challenge_id, r.event_id, r.rejected
+        ),
+        lost AS (
+            SELECT deleted.user_id, deleted.challenge_id,
+                   SUM(COALESCE(CASE WHEN deleted.event_id IS NOT NULL
+                                     THEN e.points_per_report ELSE c.points_per_report END, 0)) AS points
+            FROM deleted
+            LEFT JOIN events e ON e.id = deleted.event_id
+            LEFT JOIN challenges c ON c.id = deleted.challenge_id
+            WHERE deleted.challenge_id IS NOT NULL AND NOT COALESCE(deleted.rejected, false)
+            GROUP BY deleted.user_id, deleted.challenge_id
+        )
+        UPDATE challenge_participants p
+        SET points = GREATEST(COALESCE(p.points, 0) - lost.points, 0)
+        FROM lost
+        WHERE p.user_id = lost.user_id AND p.challenge_id = lost.challenge_id
+    """)
+    op.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_challenge_participants_user_challenge') THEN
+                ALTER TABLE challenge_participants
+                    ADD CONSTRAINT uq_challenge_participants_user_challenge UNIQUE (user_id, challenge_id);
+            END IF;
+        END $$
+    """)
+
+    with op.get_context().autocommit_block():
+        for name, target, replaced in UNIQUE_INDEXES:
+            _drop_invalid_index(name)
+            op.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+            # Старый индекс удаляем, только когда уникальный действительно работает
+            if not _index_is_valid(name):
+                raise RuntimeError(f"Index {name} is not valid; remove duplicate reports and rerun the migration")
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {replaced}")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uq_user_reports_user_event")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uq_user_reports_daily")
+    op.drop_constraint("uq_challenge_participants_user_challenge", "challenge_participants", type_="unique")
@@ -0,0 +1,64 @@
+"""index pack for hot queries
+
+Индексы строятся CONCURRENTLY, чтобы не блокировать запись в таблицы.
+
+- challenges (start_date, end_date): активные челленджи на дату
+- challenge_participants (challenge_id, points DESC, joined_at): рейтинг;
+  поиск участника по (user_id, challenge_id) покрывает уникальное ограничение
+- user_reports (challenge_id | user_id | event_id, created_at, id): keyset-пагинация
+  списков отчётов; поиск отчёта за день и по мероприятию покрывают уникальные индексы
+- events (challenge_id): мероприятия челленджа
+- report_photos (report_id): загрузка фото отчётов
+- report_photos (content_hash): счётчик ссылок на файл и сборка мусора
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_challenges_period", "challenges (start_date, end_date)"),
+    ("ix_challenge_participants_ranking", "challenge_participants (challenge_id, points DESC, joined_at)"),
+    ("ix_user_reports_challenge_created", "user_reports (challenge_id, created_at, id)"),
+    ("ix_user_reports_user_created", "user_reports (user_id, created_at, id)"),
+    ("ix_user_reports_event_created", "user_reports (event_id, created_at, id)"),
+    ("ix_events_challenge_id", "events (challenge_id)"),
+    ("ix_report_photos_report_id", "report_photos (report_id)"),
+    ("ix_report_photos_content_hash", "report_photos (content_hash)"),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, target in INDEXES:
+            # Недостроенный после сбоя CONCURRENTLY индекс остаётся INVALID: удаляем его и строим заново
+            op.execute(f"""
+                DO $$
+                BEGIN
+                    IF EXISTS (
+                        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = '{name}' AND NOT i.indisvalid
+                    ) THEN
+                        EXECUTE 'DROP INDEX {name}';
+                    END IF;
+                END $$
+            """)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
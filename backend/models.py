@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Date
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Date, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -37,11 +37,15 @@ class Challenge(Base):
     participants = relationship("ChallengeParticipant", back_populates="challenge", cascade="all, delete-orphan")
     reports = relationship("UserReport", back_populates="challenge", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_challenges_period", "start_date", "end_date"),
+    )
+
 class Event(Base):
     __tablename__ = "events"
     
     id = Column(Integer, primary_key=True, nullable=False)
-    challenge_id = Column(Integer, ForeignKey("challenges.id", ondelete="CASCADE"), nullable=False)
+    challenge_id = Column(Integer, ForeignKey("challenges.id", ondelete="CASCADE"), nullable=False, index=True)
     title = Column(String, nullable=False)
     description = Column(String, nullable=False)
     date = Column(DateTime, nullable=False)
@@ -66,6 +70,11 @@ class ChallengeParticipant(Base):
     user = relationship("User")
     challenge = relationship("Challenge", back_populates="participants")
 
+    __table_args__ = (
+        Index("ix_challenge_participants_ranking", "challenge_id", points.desc(), "joined_at"),
+        UniqueConstraint("user_id", "challenge_id", name="uq_challenge_participants_user_challenge"),
+    )
+
 class UserReport(Base):
     __tablename__ = "user_reports"
 
@@ -85,12 +94,28 @@ class UserReport(Base):
     event = relationship("Event", back_populates="reports")
     photos = relationship("ReportPhoto", back_populates="report", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_user_reports_challenge_created", "challenge_id", "created_at", "id"),
+        Index("ix_user_reports_user_created", "user_id", "created_at", "id"),
+        Index("ix_user_reports_event_created", "event_id", "created_at", "id"),
+        # Один ежедневный отчёт на день челленджа и один отчёт на мероприятие
+        Index(
+            "uq_user_reports_daily", "user_id", "challenge_id", "report_date",
+            unique=True, postgresql_where=event_id.is_(None)
+        ),
+        Index("uq_user_reports_user_event", "user_id", "event_id", unique=True),
+    )
+
 class ReportPhoto(Base):
     __tablename__ = "report_photos"
 
     id = Column(Integer, primary_key=True, index=True)
-    report_id = Column(Integer, ForeignKey("user_reports.id", ondelete="CASCADE"), nullable=False)
+    report_id = Column(Integer, ForeignKey("user_reports.id", ondelete="CASCADE"), nullable=False, index=True)
     photo_url = Column(String(255), nullable=False)
+    # SHA-256 содержимого: один файл может использоваться несколькими строками,
+    # число строк с данным хешем — счётчик ссылок на файл
+    content_hash = Column(String(64), nullable=True, index=True)
+    size_bytes = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     report = relationship("UserReport", back_populates="photos")
@@ -1,11 +1,113 @@
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import tuple_, and_, or_, func, update, String
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from typing import List, Optional
-from datetime import datetime, date
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import selectinload, aliased
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from datetime import datetime, date, time, timedelta
 from fastapi import Request
 
 from . import models
+from .images import variant_urls
+
+
+# Строки для списков только на чтение: Core-запрос нужных колонок без identity map
+# и загрузчиков связей. Поля и их порядок совпадают со схемами ответа.
+
+@dataclass(slots=True)
+class UserRow:
+    telegram_id: str
+    username: Optional[str]
+    phone_number: Optional[str]
+    id: int
+    created_at: datetime
+
+
+@dataclass(slots=True)
+class ReportPhotoRow:
+    id: int
+    report_id: int
+    photo_url: str
+    created_at: datetime
+    variants: Dict[str, str]
+
+
+@dataclass(slots=True)
+class ReportRow:
+    user_id: int
+    text_content: str
+    challenge_id: Optional[int]
+    event_id: Optional[int]
+    report_date: date
+    id: int
+    created_at: datetime
+    rejected: bool
+    rejected_at: Optional[datetime]
+    user: UserRow
+    photos: List[ReportPhotoRow] = field(default_factory=list)
+    points: Optional[int] = None
+
+
+@dataclass(slots=True)
+class ChallengeRow:
+    title: str
+    description: str
+    start_date: date
+    end_date: date
+    requires_phone: bool
+    points_per_report: int
+    required_photos: int
+    id: int
+    created_at: datetime
+
+
+@dataclass(slots=True)
+class EventRow:
+    title: str
+    description: str
+    date: date
+    points_per_report: int
+    required_photos: int
+    id: int
+    challenge_id: int
+    created_at: datetime
+
+
+@dataclass(slots=True)
+class LeaderboardEntryRow:
+    rank: int
+    user_id: int
+    username: str
+    points: int
+    joined_at: Optional[datetime]
+
+
+@dataclass(slots=True)
+class LeaderboardRow:
+    total: int
+    top: List[LeaderboardEntryRow]
+    me: Optional[LeaderboardEntryRow]
+    around: List[LeaderboardEntryRow]
+
+
+_USER_COLUMNS = (
+    models.User.telegram_id,
+    models.User.username,
+    models.User.phone_number,
+    models.User.id.label("user_pk"),
+    models.User.created_at.label("user_created_at"),
+)
+
+
+def _user_row(row) -> UserRow:
+    return UserRow(row.telegram_id, row.username, row.phone_number, row.user_pk, row.user_created_at)
+
+
+def _as_date(value):
+    # Даты челленджей и мероприятий хранятся в DateTime, а отдаются как date
+    return value.date() if isinstance(value, datetime) else value
+
 
 class ChallengeRepository:
     def __init__(self, db: AsyncSession):
@@ -18,11 +120,44 @@ class ChallengeRepository:
         await self.db.refresh(challenge)
         return challenge
 
-    async def get_all_challenges(self):
+    async def get_all_challenges(self) -> List[ChallengeRow]:
+        challenge = models.Challenge
         result = await self.db.execute(
-            select(models.Challenge).options(selectinload(models.Challenge.events))
+            select(
+                challenge.title,
+                challenge.description,
+                challenge.start_date,
+                challenge.end_date,
+                challenge.requires_phone,
+                challenge.points_per_report,
+                challenge.required_photos,
+                challenge.id,
+                challenge.created_at
+            )
+            .order_by(challenge.id)
         )
-        return result.scalars().all()
+        return [
+            ChallengeRow(
+                row.title, row.description, _as_date(row.start_date), _as_date(row.end_date), row.requires_phone,
+                row.points_per_report, row.required_photos, row.id, row.created_at
+            )
+            for row in result
+        ]
+
+    async def get_active_challenges(self, on: date, limit: int, offset: int = 0):
+        """Возвращает id и название челленджей, активных на указанную дату"""
+        day_start = datetime.combine(on, time.min)
+        result = await self.db.execute(
+            select(models.Challenge.id, models.Challenge.title)
+            .where(
+                models.Challenge.start_date < day_start + timedelta(days=1),
+                models.Challenge.end_date >= day_start
+            )
+            .order_by(models.Challenge.start_date, models.Challenge.id)
+            .limit(limit)
+            .offset(offset)
+        )
+        return result.all()
 
     async def get_challenge(self, challenge_id: int):
         result = await self.db.execute(
@@ -32,6 +167,61 @@ class ChallengeRepository:
         )
         return result.scalar_one_or_none()
 
+    async def get_challenge_view(self, challenge_id: int, telegram_id: str):
+        """Челлендж и состояние пользователя в нём: участие, очки, место и число дней с отчётами.
+
+        Возвращает (challenge, row); row равен None, если пользователь не найден.
+        """
+        challenge_result = await self.db.execute(
+            select(models.Challenge).where(models.Challenge.id == challenge_id)
+        )
+        challenge = challenge_result.scalar_one_or_none()
+        if challenge is None:
+            return None, None
+
+        participant = models.ChallengeParticipant
+        other = aliased(models.ChallengeParticipant)
+        rank = (
+            select(func.count() + 1)
+            .where(
+                other.challenge_id == challenge_id,
+                or_(
+                    other.points > participant.points,
+                    and_(other.points == participant.points, other.joined_at < participant.joined_at),
+                    and_(
+                        other.points == participant.points,
+                        other.joined_at == participant.joined_at,
+                        other.id < participant.id
+                    )
+                )
+            )
+            .scalar_subquery()
+        )
+        report_days = (
+            select(func.count())
+            .where(
+                models.UserReport.user_id == models.User.id,
+                models.UserReport.challenge_id == challenge_id,
+                models.UserReport.event_id.is_(None)
+            )
+            .scalar_subquery()
+        )
+        result = await self.db.execute(
+            select(
+                models.User,
+                participant.id.label("participant_id"),
+                participant.points,
+                rank.label("rank"),
+                report_days.label("report_days")
+            )
+            .outerjoin(
+                participant,
+                and_(participant.user_id == models.User.id, participant.challenge_id == challenge_id)
+            )
+            .where(models.User.telegram_id == telegram_id)
+        )
+        return challenge, result.first()
+
     async def update_challenge(self, challenge_id: int, **kwargs):
         challenge = await self.get_challenge(challenge_id)
         if challenge:
@@ -67,11 +257,29 @@ class EventRepository:
         )
         return result.scalar_one_or_none()
 
-    async def get_challenge_events(self, challenge_id: int):
+    async def get_challenge_events(self, challenge_id: int) -> List[EventRow]:
+        event = models.Event
         result = await self.db.execute(
-            select(models.Event).where(models.Event.challenge_id == challenge_id)
+            select(
+                event.title,
+                event.description,
+                event.date,
+                event.points_per_report,
+                event.required_photos,
+                event.id,
+                event.challenge_id,
+                event.created_at
+            )
+            .where(event.challenge_id == challenge_id)
+            .order_by(event.id)
         )
-        return result.scalars().all()
+        return [
+            EventRow(
+                row.title, row.description, _as_date(row.date), row.points_per_report, row.required_photos,
+                row.id, row.challenge_id, row.created_at
+            )
+            for row in result
+        ]
 
     async def update_event(self, event_id: int, **kwargs):
         event = await self.get_event(event_id)
@@ -96,14 +304,18 @@ class ChallengeParticipantRepository:
         self.db = db
 
     async def join_challenge(self, user_id: int, challenge_id: int):
-        participant = models.ChallengeParticipant(
-            user_id=user_id,
-            challenge_id=challenge_id,
-            joined_at=datetime.utcnow()
+        """Идемпотентное вступление: при повторном вызове возвращает существующее участие"""
+        result = await self.db.execute(
+            insert(models.ChallengeParticipant)
+            .values(user_id=user_id, challenge_id=challenge_id, joined_at=datetime.utcnow(), points=0)
+            .on_conflict_do_nothing(index_elements=["user_id", "challenge_id"])
+            .returning(models.ChallengeParticipant),
+            execution_options={"populate_existing": True}
         )
-        self.db.add(participant)
+        participant = result.scalar_one_or_none()
         await self.db.commit()
-        await self.db.refresh(participant)
+        if participant is None:
+            participant = await self.get_participant(user_id, challenge_id)
         return participant
 
     async def is_joined(self, user_id: int, challenge_id: int):
@@ -124,15 +336,82 @@ class ChallengeParticipantRepository:
         )
         return result.scalar_one_or_none()
 
-    async def get_challenge_participants_with_users(self, challenge_id: int):
-        """Получает всех участников челленджа с информацией о пользователях"""
+    async def change_report_points(self, user_id: int, challenge_id: int, event_id: Optional[int] = None, sign: int = 1):
+        """Атомарно начисляет (sign=1) или списывает (sign=-1) баллы за отчёт.
+
+        Стоимость отчёта берётся из мероприятия или челленджа прямо в UPDATE.
+        Не коммитит: вызывается внутри транзакции создания/отклонения отчёта.
+        Возвращает новый баланс или None, если пользователь не участник.
+        """
+        participant = models.ChallengeParticipant
+        if event_id:
+            report_points = select(models.Event.points_per_report).where(models.Event.id == event_id)
+        else:
+            report_points = select(models.Challenge.points_per_report).where(models.Challenge.id == challenge_id)
+        new_points = func.coalesce(participant.points, 0) + sign * func.coalesce(report_points.scalar_subquery(), 0)
         result = await self.db.execute(
-            select(models.ChallengeParticipant)
-            .options(selectinload(models.ChallengeParticipant.user))
+            update(participant)
+            .where(participant.user_id == user_id, participant.challenge_id == challenge_id)
+            .values(points=func.greatest(new_points, 0))
+            .returning(participant.points)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_leaderboard(self, challenge_id: int, limit: int, user_id: Optional[int] = None, around: int = 0):
+        """Топ-N участников и окрестность пользователя user_id (±around мест) с рангом и общим числом участников.
+
+        Ранг считается оконной функцией по (points DESC, joined_at ASC) за один запрос.
+        """
+        participant = models.ChallengeParticipant
+        ranked = (
+            select(
+                participant.user_id,
+                participant.points,
+                participant.joined_at,
+                func.row_number().over(
+                    order_by=(participant.points.desc(), participant.joined_at.asc(), participant.id.asc())
+                ).label("rank"),
+                func.count().over().label("total")
+            )
+            .where(participant.challenge_id == challenge_id)
+            .cte("ranked")
+        )
+        condition = ranked.c.rank <= limit
+        if user_id is not None:
+            user_rank = select(ranked.c.rank).where(ranked.c.user_id == user_id).scalar_subquery()
+            condition = or_(condition, ranked.c.rank.between(user_rank - around, user_rank + around))
+        result = await self.db.execute(
+            select(ranked, models.User.username)
+            .join(models.User, models.User.id == ranked.c.user_id)
+            .where(condition)
+            .order_by(ranked.c.rank)
+        )
+        return result.all()
+
+    def _ranking_rows_query(self, challenge_id: int):
+        return (
+            select(
+                models.ChallengeParticipant.id,
+                models.ChallengeParticipant.user_id,
+                models.ChallengeParticipant.points,
+                models.ChallengeParticipant.joined_at,
+                models.User.username
+            )
+            .join(models.User, models.User.id == models.ChallengeParticipant.user_id)
             .where(models.ChallengeParticipant.challenge_id == challenge_id)
-            .order_by(models.ChallengeParticipant.points.desc())
         )
-        return result.scalars().all()
+
+    async def get_ranking_rows(self, challenge_id: int):
+        """Участники челленджа для прогрева рейтинга в памяти"""
+        result = await self.db.execute(self._ranking_rows_query(challenge_id))
+        return result.all()
+
+    async def get_ranking_row(self, user_id: int, challenge_id: int):
+        result = await self.db.execute(
+            self._ranking_rows_query(challenge_id).where(models.ChallengeParticipant.user_id == user_id)
+        )
+        return result.first()
 
 class ReportRepository:
     def __init__(self, db: AsyncSession):
@@ -145,6 +424,20 @@ class ReportRepository:
         await self.db.refresh(report)
         return report
 
+    async def insert_report(self, **kwargs) -> Optional[int]:
+        """Вставляет отчёт в текущую транзакцию без коммита.
+
+        Дубликаты отсекаются уникальными индексами (ON CONFLICT DO NOTHING):
+        в этом случае возвращается None, иначе id нового отчёта.
+        """
+        result = await self.db.execute(
+            insert(models.UserReport)
+            .values(**kwargs)
+            .on_conflict_do_nothing()
+            .returning(models.UserReport.id)
+        )
+        return result.scalar_one_or_none()
+
     async def exists_report_for_day(self, user_id, challenge_id, report_date) -> bool:
         if isinstance(report_date, str):
             report_date = datetime.strptime(report_date, "%Y-%m-%d").date()
@@ -158,13 +451,76 @@ class ReportRepository:
         )
         return result.scalar_one_or_none() is not None
 
-    async def add_photos(self, report_id: int, photo_urls: List[str]):
+    async def get_report_dates(self, user_id: int, challenge_id: int):
+        """Дата начала челленджа и даты ежедневных отчётов пользователя одним запросом.
+
+        Возвращает None, если челлендж не найден.
+        """
+        result = await self.db.execute(
+            select(models.Challenge.start_date, models.UserReport.report_date)
+            .outerjoin(
+                models.UserReport,
+                and_(
+                    models.UserReport.challenge_id == models.Challenge.id,
+                    models.UserReport.user_id == user_id,
+                    models.UserReport.event_id.is_(None)
+                )
+            )
+            .where(models.Challenge.id == challenge_id)
+            .order_by(models.UserReport.report_date)
+        )
+        rows = result.all()
+        if not rows:
+            return None
+        start_date = rows[0].start_date
+        return start_date, [row.report_date for row in rows if row.report_date is not None]
+
+    async def get_storage_by_challenge(self):
+        """Объём фото по челленджам: число фото, уникальных файлов и их суммарный размер.
+
+        Одинаковые файлы внутри челленджа считаются один раз; фото без хеша
+        (не перенесённые в хранилище по хешу) считаются отдельными файлами без размера.
+        """
+        challenge_id = func.coalesce(models.UserReport.challenge_id, models.Event.challenge_id)
+        file_key = func.coalesce(models.ReportPhoto.content_hash, func.cast(models.ReportPhoto.id, String))
+        files = (
+            select(
+                challenge_id.label("challenge_id"),
+                func.count().label("photos"),
+                func.max(models.ReportPhoto.size_bytes).label("size_bytes"),
+            )
+            .select_from(models.ReportPhoto)
+            .join(models.UserReport, models.UserReport.id == models.ReportPhoto.report_id)
+            .outerjoin(models.Event, models.Event.id == models.UserReport.event_id)
+            .group_by(challenge_id, file_key)
+            .subquery()
+        )
+        result = await self.db.execute(
+            select(
+                models.Challenge.id.label("challenge_id"),
+                models.Challenge.title,
+                func.sum(files.c.photos).label("photos"),
+                func.count().label("files"),
+                func.coalesce(func.sum(files.c.size_bytes), 0).label("bytes"),
+            )
+            .join(files, files.c.challenge_id == models.Challenge.id)
+            .group_by(models.Challenge.id, models.Challenge.title)
+            .order_by(func.coalesce(func.sum(files.c.size_bytes), 0).desc())
+        )
+        return result.all()
+
+    async def add_photos(self, report_id: int, photos: List[dict]):
+        photos = self.insert_photos(report_id, photos)
+        await self.db.commit()
+        return photos
+
+    def insert_photos(self, report_id: int, photos: List[dict]):
+        """Добавляет фото отчёта в текущую транзакцию без коммита"""
         photos = [
-            models.ReportPhoto(report_id=report_id, photo_url=url)
-            for url in photo_urls
+            models.ReportPhoto(report_id=report_id, **photo)
+            for photo in photos
         ]
         self.db.add_all(photos)
-        await self.db.commit()
         return photos
 
     async def get_report(self, report_id: int, request: Request = None):
@@ -175,29 +531,82 @@ class ReportRepository:
         )
         return result.scalar_one_or_none()
 
-    async def get_user_reports(self, user_id: int, request: Request = None):
-        result = await self.db.execute(
-            select(models.UserReport)
-            .options(selectinload(models.UserReport.user), selectinload(models.UserReport.photos))
-            .where(models.UserReport.user_id == user_id)
+    def _reports_page_query(self, *criteria, cursor=None, limit=None, date_from=None, date_to=None):
+        """Запрос отчётов с автором по убыванию (created_at, id) с keyset-пагинацией и фильтром по report_date"""
+        report = models.UserReport
+        query = (
+            select(
+                report.user_id,
+                report.text_content,
+                report.challenge_id,
+                report.event_id,
+                report.report_date,
+                report.id,
+                report.created_at,
+                report.rejected,
+                report.rejected_at,
+                *_USER_COLUMNS
+            )
+            .join(models.User, models.User.id == report.user_id)
+            .where(*criteria)
         )
-        return result.scalars().all()
+        if date_from is not None:
+            query = query.where(report.report_date >= date_from)
+        if date_to is not None:
+            query = query.where(report.report_date <= date_to)
+        if cursor is not None:
+            created_at, report_id = cursor
+            query = query.where(tuple_(report.created_at, report.id) < tuple_(created_at, report_id))
+        query = query.order_by(report.created_at.desc(), report.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return query
 
-    async def get_challenge_reports(self, challenge_id: int, request: Request = None):
+    async def get_report_rows(self, *criteria, **page) -> List[ReportRow]:
+        """Страница отчётов в виде ReportRow: один запрос отчётов с авторами и один — их фото"""
+        reports = [
+            ReportRow(
+                row.user_id, row.text_content, row.challenge_id, row.event_id, row.report_date,
+                row.id, row.created_at, row.rejected, row.rejected_at, _user_row(row)
+            )
+            for row in await self.db.execute(self._reports_page_query(*criteria, **page))
+        ]
+        if not reports:
+            return reports
+        by_id = {report.id: report for report in reports}
+        photo = models.ReportPhoto
         result = await self.db.execute(
-            select(models.UserReport)
-            .options(selectinload(models.UserReport.user), selectinload(models.UserReport.photos))
-            .where(models.UserReport.challenge_id == challenge_id)
+            select(photo.id, photo.report_id, photo.photo_url, photo.created_at, photo.content_hash)
+            .where(photo.report_id.in_(list(by_id)))
+            .order_by(photo.id)
         )
-        return result.scalars().all()
+        for row in result:
+            by_id[row.report_id].photos.append(ReportPhotoRow(
+                row.id, row.report_id, row.photo_url, row.created_at,
+                variant_urls(row.photo_url) if row.content_hash else {}
+            ))
+        return reports
 
-    async def get_event_reports(self, event_id: int):
+    async def get_user_reports(self, user_id: int, request: Request = None, **page) -> List[ReportRow]:
+        return await self.get_report_rows(models.UserReport.user_id == user_id, **page)
+
+    async def get_challenge_reports(self, challenge_id: int, request: Request = None, **page) -> List[ReportRow]:
+        return await self.get_report_rows(models.UserReport.challenge_id == challenge_id, **page)
+
+    async def get_event_reports(self, event_id: int, **page) -> List[ReportRow]:
+        return await self.get_report_rows(models.UserReport.event_id == event_id, **page)
+
+    async def get_user_event_report(self, user_id: int, event_id: int):
         result = await self.db.execute(
             select(models.UserReport)
             .options(selectinload(models.UserReport.user), selectinload(models.UserReport.photos))
-            .where(models.UserReport.event_id == event_id)
+            .where(
+                models.UserReport.user_id == user_id,
+                models.UserReport.event_id == event_id
+            )
+            .limit(1)
         )
-        return result.scalars().all()
+        return result.scalar_one_or_none()
 
     async def reject_report(self, report_id: int):
         result = await self.db.execute(
@@ -0,0 +1,51 @@
+"""Быстрая сериализация списков только на чтение.
+
+Строки из Core-запросов (dataclass) и словари кодируются orjson напрямую, без
+повторной валидации через response_model: response_model маршрута остаётся
+только для схемы OpenAPI.
+
+Потоком (частями по JSON_STREAM_CHUNK строк) отдаются только списки длиннее
+JSON_STREAM_THRESHOLD. На практике это непостраничные списки челленджей и
+мероприятий: страницы отчётов ограничены REPORTS_PAGE_MAX (200) строками и
+всегда кодируются одним буфером.
+"""
+import os
+from typing import Any, Iterator, Optional, Sequence
+
+import orjson
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from .pagination import NEXT_CURSOR_HEADER
+
+JSON_STREAM_THRESHOLD = int(os.getenv("JSON_STREAM_THRESHOLD", "1000"))
+JSON_STREAM_CHUNK = int(os.getenv("JSON_STREAM_CHUNK", "500"))
+
+
+class RowsResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def _iter_json_array(rows: Sequence[Any], chunk: int) -> Iterator[bytes]:
+    yield b"["
+    for start in range(0, len(rows), chunk):
+        part = b",".join(orjson.dumps(row) for row in rows[start:start + chunk])
+        yield part if start == 0 else b"," + part
+    yield b"]"
+
+
+def rows_response(rows: Sequence[Any], next_cursor: Optional[str] = None) -> Response:
+    """JSON-массив из уже выбранных строк; курсор следующей страницы — в заголовке.
+
+    Строки должны быть загружены до ответа: сессия БД к моменту отправки тела
+    может быть уже закрыта.
+    """
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    if len(rows) > JSON_STREAM_THRESHOLD:
+        return StreamingResponse(
+            _iter_json_array(rows, JSON_STREAM_CHUNK), media_type=RowsResponse.media_type, headers=headers
+        )
+    return RowsResponse(rows, headers=headers)
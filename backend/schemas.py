@@ -1,6 +1,8 @@
 from datetime import date, datetime
-from typing import Optional, List
-from pydantic import BaseModel
+from typing import Optional, List, Dict
+from pydantic import BaseModel, Field, computed_field
+
+from .images import variant_urls
 
 class ChallengeBase(BaseModel):
     title: str
@@ -30,6 +32,13 @@ class Challenge(ChallengeBase):
     class Config:
         from_attributes = True
 
+class ChallengeBrief(BaseModel):
+    id: int
+    title: str
+
+    class Config:
+        from_attributes = True
+
 class EventBase(BaseModel):
     title: str
     description: str
@@ -83,6 +92,28 @@ class ChallengeParticipant(ChallengeParticipantBase):
     class Config:
         from_attributes = True
 
+class ChallengeView(BaseModel):
+    """Данные карточки челленджа в боте"""
+    challenge: Challenge
+    user: Optional[User] = None
+    joined: bool = False
+    points: Optional[int] = None
+    rank: Optional[int] = None
+    report_days: int = 0
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    username: str
+    points: int
+    joined_at: Optional[datetime] = None
+
+class Leaderboard(BaseModel):
+    total: int
+    top: List[LeaderboardEntry]
+    me: Optional[LeaderboardEntry] = None
+    around: List[LeaderboardEntry] = []
+
 class UserUpdate(BaseModel):
     telegram_id: Optional[str] = None
     username: Optional[str] = None
@@ -92,8 +123,15 @@ class ReportPhoto(BaseModel):
     id: int
     report_id: int
     photo_url: str
+    content_hash: Optional[str] = Field(None, exclude=True)
     created_at: datetime
 
+    @computed_field
+    @property
+    def variants(self) -> Dict[str, str]:
+        """URL уменьшенных копий (thumb, preview); только для фото в хранилище по хешу"""
+        return variant_urls(self.photo_url) if self.content_hash else {}
+
     class Config:
         from_attributes = True
 
@@ -114,6 +152,24 @@ class Report(ReportBase):
     rejected_at: Optional[datetime] = None
     user: User
     photos: List[ReportPhoto]
+    # Баланс участника после начисления/списания баллов за этот отчёт
+    points: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class ReportDays(BaseModel):
+    """Дни с отчётами в виде смещений (в днях) от start_date челленджа"""
+    start_date: date
+    offsets: List[int]
+
+class ChallengeStorage(BaseModel):
+    """Место, занимаемое фото отчётов челленджа"""
+    challenge_id: int
+    title: str
+    photos: int
+    files: int
+    bytes: int
 
     class Config:
         from_attributes = True
@@ -1,17 +1,22 @@
 from datetime import date
 from typing import Optional, List
 import os
-import aiofiles
-from fastapi import UploadFile
-from .repository import ChallengeRepository, EventRepository, ChallengeParticipantRepository, ReportRepository
+from fastapi import UploadFile, HTTPException
+from .repository import ChallengeRepository, EventRepository, ChallengeParticipantRepository, ReportRepository, ChallengeRow, LeaderboardRow, LeaderboardEntryRow
 from .models import Challenge, Event, UserReport, ReportPhoto
-from .schemas import ReportCreate, Report
+from .schemas import ReportCreate, Report, ReportDays, ChallengeView, ChallengeStorage
+from .pagination import encode_cursor, decode_cursor, REPORTS_PAGE_DEFAULT
+from .leaderboard import LeaderboardEngine
+from .database import recent_writes
+from .storage import save_uploads, discard_created, REPORT_URL_PREFIX, REPORT_UPLOAD_DIR
+from .images import ImagePipeline
 from datetime import datetime
 import logging
 
 class ChallengeService:
-    def __init__(self, challenge_repository: ChallengeRepository):
+    def __init__(self, challenge_repository: ChallengeRepository, leaderboard: Optional[LeaderboardEngine] = None):
         self.repository = challenge_repository
+        self.leaderboard = leaderboard
 
     async def create_challenge(self, 
         title: str,
@@ -35,9 +40,28 @@ class ChallengeService:
     async def get_challenge(self, challenge_id: int) -> Optional[Challenge]:
         return await self.repository.get_challenge(challenge_id)
 
-    async def get_all_challenges(self) -> list[Challenge]:
+    async def get_all_challenges(self) -> list[ChallengeRow]:
         return await self.repository.get_all_challenges()
 
+    async def get_active_challenges(self, on: date, limit: int, offset: int = 0):
+        return await self.repository.get_active_challenges(on, limit, offset)
+
+    async def get_challenge_view(self, challenge_id: int, telegram_id: str) -> Optional[ChallengeView]:
+        challenge, row = await self.repository.get_challenge_view(challenge_id, telegram_id)
+        if challenge is None:
+            return None
+        if row is None:
+            return ChallengeView(challenge=challenge)
+        joined = row.participant_id is not None
+        return ChallengeView(
+            challenge=challenge,
+            user=row.User,
+            joined=joined,
+            points=(row.points or 0) if joined else None,
+            rank=row.rank if joined else None,
+            report_days=row.report_days
+        )
+
     async def update_challenge(self, 
         challenge_id: int,
         title: Optional[str] = None,
@@ -59,10 +83,16 @@ class ChallengeService:
                 "required_photos": required_photos
             }.items() if v is not None
         }
-        return await self.repository.update_challenge(challenge_id, **challenge_data)
+        challenge = await self.repository.update_challenge(challenge_id, **challenge_data)
+        recent_writes.mark(challenge_id=challenge_id)
+        return challenge
 
     async def delete_challenge(self, challenge_id: int) -> bool:
-        return await self.repository.delete_challenge(challenge_id)
+        deleted = await self.repository.delete_challenge(challenge_id)
+        recent_writes.mark(challenge_id=challenge_id)
+        if deleted and self.leaderboard is not None:
+            self.leaderboard.invalidate(challenge_id)
+        return deleted
 
 class EventService:
     def __init__(self, event_repository: EventRepository):
@@ -76,7 +106,7 @@ class EventService:
         points_per_report: int,
         required_photos: int
     ) -> Event:
-        return await self.repository.create_event(
+        event = await self.repository.create_event(
             challenge_id=challenge_id,
             title=title,
             description=description,
@@ -84,6 +114,8 @@ class EventService:
             points_per_report=points_per_report,
             required_photos=required_photos
         )
+        recent_writes.mark(challenge_id=challenge_id)
+        return event
 
     async def get_event(self, event_id: int) -> Optional[Event]:
         return await self.repository.get_event(event_id)
@@ -108,88 +140,136 @@ class EventService:
                 "required_photos": required_photos
             }.items() if v is not None
         }
-        return await self.repository.update_event(event_id, **event_data)
+        event = await self.repository.update_event(event_id, **event_data)
+        if event is not None:
+            recent_writes.mark(challenge_id=event.challenge_id)
+        return event
 
     async def delete_event(self, event_id: int) -> bool:
-        return await self.repository.delete_event(event_id)
+        event = await self.repository.get_event(event_id)
+        if event is None:
+            return False
+        challenge_id = event.challenge_id
+        deleted = await self.repository.delete_event(event_id)
+        recent_writes.mark(challenge_id=challenge_id)
+        return deleted
 
 class ChallengeParticipantService:
-    def __init__(self, participant_repository: ChallengeParticipantRepository):
+    def __init__(self, participant_repository: ChallengeParticipantRepository, leaderboard: Optional[LeaderboardEngine] = None):
         self.repository = participant_repository
+        self.leaderboard = leaderboard
 
     async def join_challenge(self, user_id: int, challenge_id: int):
-        return await self.repository.join_challenge(user_id, challenge_id)
+        participant = await self.repository.join_challenge(user_id, challenge_id)
+        recent_writes.mark(user_id=user_id)
+        if self.leaderboard is not None:
+            row = await self.repository.get_ranking_row(user_id, challenge_id)
+            if row:
+                self.leaderboard.add_participant(challenge_id, row.id, row.user_id, row.points, row.joined_at, row.username)
+        return participant
 
     async def is_joined(self, user_id: int, challenge_id: int) -> bool:
         return await self.repository.is_joined(user_id, challenge_id)
 
+    async def get_leaderboard(self, challenge_id: int, limit: int, user_id: Optional[int] = None, around: int = 0) -> LeaderboardRow:
+        if self.leaderboard is not None:
+            ranking = await self.leaderboard.get_ranking(challenge_id, self.repository)
+            total = len(ranking)
+            rows = ranking.top(limit)
+            if user_id is not None:
+                rows += [row for row in ranking.around(user_id, around) if row["rank"] > limit]
+        else:
+            result = await self.repository.get_leaderboard(challenge_id, limit, user_id, around)
+            total = result[0].total if result else 0
+            rows = [row._mapping for row in result]
+
+        entries = [
+            LeaderboardEntryRow(
+                rank=row["rank"],
+                user_id=row["user_id"],
+                username=row["username"] or "Аноним",
+                points=row["points"] or 0,
+                joined_at=row["joined_at"]
+            )
+            for row in rows
+        ]
+        me = next((e for e in entries if e.user_id == user_id), None)
+        return LeaderboardRow(
+            total=total,
+            top=[e for e in entries if e.rank <= limit],
+            me=me,
+            around=[e for e in entries if me and abs(e.rank - me.rank) <= around]
+        )
+
 class ReportService:
-    def __init__(self, report_repository: ReportRepository, upload_dir: str = "uploads/reports"):
+    def __init__(self, report_repository: ReportRepository, upload_dir: str = REPORT_UPLOAD_DIR,
+                 leaderboard: Optional[LeaderboardEngine] = None, images: Optional[ImagePipeline] = None):
         self.report_repository = report_repository
         self.upload_dir = upload_dir
+        self.leaderboard = leaderboard
+        self.images = images
 
-    async def create_report(self, report_data: ReportCreate) -> Report:
+    async def create_report(self, report_data: ReportCreate, photos: Optional[List[UploadFile]] = None) -> Report:
+        """Создаёт отчёт и начисляет баллы; с photos — вместе с фотографиями.
+
+        Файлы пишутся до транзакции, а отчёт, строки фото и баллы фиксируются
+        одним коммитом: либо сохраняется всё, либо ничего.
+        """
         logger = logging.getLogger(__name__)
         
         logger.info(f"Creating report: user_id={report_data.user_id}, challenge_id={report_data.challenge_id}, event_id={report_data.event_id}, report_date={report_data.report_date}")
         
-        # Проверка: отчёт за этот день уже есть? (только для челленджей, не для мероприятий)
-        if report_data.challenge_id and not report_data.event_id:
-            logger.info(f"Checking for existing daily report for challenge {report_data.challenge_id}, date {report_data.report_date}")
-            exists = await self.report_repository.exists_report_for_day(
-                report_data.user_id, report_data.challenge_id, str(report_data.report_date)
+        stored = []
+        if photos is not None:
+            required_photos = await self._required_photos(report_data.challenge_id, report_data.event_id)
+            if len(photos) != required_photos:
+                raise ValueError(f"Expected {required_photos} photos, but got {len(photos)}")
+            stored = await self._store_photos(photos)
+
+        # Отчёт, фото и начисление баллов — одна транзакция.
+        # Повторный отчёт за день/мероприятие отсекается уникальным индексом.
+        db = self.report_repository.db
+        try:
+            report_id = await self.report_repository.insert_report(
+                user_id=report_data.user_id,
+                text_content=report_data.text_content,
+                challenge_id=report_data.challenge_id,
+                event_id=report_data.event_id,
+                report_date=report_data.report_date,
+                created_at=datetime.utcnow()
             )
-            if exists:
+            if report_id is None:
+                await db.rollback()
+                if report_data.event_id:
+                    logger.warning(f"Event report already exists for user {report_data.user_id}, event {report_data.event_id}")
+                    raise HTTPException(status_code=409, detail="Отчёт для этого мероприятия уже отправлен")
                 logger.warning(f"Daily report already exists for user {report_data.user_id}, challenge {report_data.challenge_id}, date {report_data.report_date}")
-                from fastapi import HTTPException
                 raise HTTPException(status_code=409, detail="Отчёт за этот день уже отправлен")
-        
-        # Проверка: отчёт для этого мероприятия уже есть?
-        if report_data.event_id:
-            logger.info(f"Checking for existing event report for event {report_data.event_id}")
-            event_reports = await self.report_repository.get_event_reports(report_data.event_id)
-            user_event_reports = [r for r in event_reports if r.user_id == report_data.user_id]
-            if user_event_reports:
-                logger.warning(f"Event report already exists for user {report_data.user_id}, event {report_data.event_id}")
-                from fastapi import HTTPException
-                raise HTTPException(status_code=409, detail="Отчёт для этого мероприятия уже отправлен")
-        
-        report = await self.report_repository.create_report(
-            user_id=report_data.user_id,
-            text_content=report_data.text_content,
-            challenge_id=report_data.challenge_id,
-            event_id=report_data.event_id,
-            report_date=report_data.report_date,
-            created_at=datetime.utcnow()
-        )
-        # Начисляем баллы участнику челленджа
-        if report_data.challenge_id:
-            from .repository import ChallengeParticipantRepository, ChallengeRepository, EventRepository
-            participant_repo = ChallengeParticipantRepository(self.report_repository.db)
-            challenge_repo = ChallengeRepository(self.report_repository.db)
-            
-            participant = await participant_repo.get_participant(report_data.user_id, report_data.challenge_id)
-            if participant:
-                points_to_add = 0
-                
-                # Если отчет для мероприятия, используем очки мероприятия
-                if report_data.event_id:
-                    event_repo = EventRepository(self.report_repository.db)
-                    event = await event_repo.get_event(report_data.event_id)
-                    if event:
-                        points_to_add = event.points_per_report
-                else:
-                    # Если отчет для челленджа, используем очки челленджа
-                    challenge = await challenge_repo.get_challenge(report_data.challenge_id)
-                    if challenge:
-                        points_to_add = challenge.points_per_report
-                
-                # Начисляем очки
-                if points_to_add > 0:
-                    participant.points += points_to_add
-                    await self.report_repository.db.commit()
+
+            if stored:
+                self.report_repository.insert_photos(report_id, self._photo_rows(stored))
+
+            points = None
+            if report_data.challenge_id:
+                participant_repo = ChallengeParticipantRepository(db)
+                points = await participant_repo.change_report_points(
+                    report_data.user_id, report_data.challenge_id, report_data.event_id
+                )
+            await db.commit()
+        except Exception as e:
+            if not isinstance(e, HTTPException):
+                await db.rollback()
+            discard_created(self.upload_dir, stored)
+            raise
+
+        # Следующие чтения пользователя идут в primary, пока реплика догоняет
+        recent_writes.mark(user_id=report_data.user_id)
+        if points is not None and self.leaderboard is not None:
+            self.leaderboard.set_points(report_data.challenge_id, report_data.user_id, points)
+        self._schedule_variants(stored)
         # Получаем полный отчет с связанными данными
-        return await self.report_repository.get_report(report.id)
+        report = await self.report_repository.get_report(report_id)
+        return Report.model_validate(report).model_copy(update={"points": points})
 
     async def upload_photos(self, report_id: int, photos: List[UploadFile]) -> List[ReportPhoto]:
         # Получаем отчет для проверки требований
@@ -197,24 +277,8 @@ class ReportService:
         if not report:
             raise ValueError(f"Report with id {report_id} not found")
         
-        # Определяем требуемое количество фотографий
-        required_photos = 1  # По умолчанию
-        if report.event_id:
-            # Для мероприятий получаем требования из события
-            from .repository import EventRepository
-            event_repo = EventRepository(self.report_repository.db)
-            event = await event_repo.get_event(report.event_id)
-            if event:
-                required_photos = event.required_photos
-        elif report.challenge_id:
-            # Для челленджей получаем требования из челленджа
-            from .repository import ChallengeRepository
-            challenge_repo = ChallengeRepository(self.report_repository.db)
-            challenge = await challenge_repo.get_challenge(report.challenge_id)
-            if challenge:
-                required_photos = challenge.required_photos
-        
         # Проверяем количество загружаемых фотографий
+        required_photos = await self._required_photos(report.challenge_id, report.event_id)
         if len(photos) != required_photos:
             raise ValueError(f"Expected {required_photos} photos, but got {len(photos)}")
         
@@ -223,38 +287,98 @@ class ReportService:
         if existing_photos_count > 0:
             raise ValueError(f"Photos already uploaded for this report. Found {existing_photos_count} existing photos.")
         
-        os.makedirs(self.upload_dir, exist_ok=True)
-        
-        photo_urls = []
-        for photo in photos:
-            # Генерируем уникальное имя файла
-            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            filename = f"{report_id}_{timestamp}_{photo.filename}"
-            filepath = os.path.join(self.upload_dir, filename)
-            
-            # Сохраняем файл
-            async with aiofiles.open(filepath, 'wb') as f:
-                content = await photo.read()
-                await f.write(content)
-            
-            # Сохраняем относительный путь к файлу
-            photo_urls.append(f"reports/{filename}")
+        stored = await self._store_photos(photos)
         
         # Добавляем фотографии в базу данных
-        photos = await self.report_repository.add_photos(report_id, photo_urls)
+        photos = await self.report_repository.add_photos(report_id, self._photo_rows(stored))
+        recent_writes.mark(user_id=report.user_id)
+        self._schedule_variants(stored)
         return photos
 
+    async def _required_photos(self, challenge_id: Optional[int], event_id: Optional[int]) -> int:
+        """Требуемое число фото: из мероприятия, иначе из челленджа, по умолчанию 1"""
+        db = self.report_repository.db
+        if event_id:
+            event = await EventRepository(db).get_event(event_id)
+            if event:
+                return event.required_photos
+        elif challenge_id:
+            challenge = await ChallengeRepository(db).get_challenge(challenge_id)
+            if challenge:
+                return challenge.required_photos
+        return 1
+
+    async def _store_photos(self, photos: List[UploadFile]):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # Сохраняем файлы потоково и параллельно; одинаковые фото хранятся один раз
+        return await save_uploads(photos, self.upload_dir)
+
+    @staticmethod
+    def _photo_rows(stored) -> List[dict]:
+        return [
+            {"photo_url": f"{REPORT_URL_PREFIX}{file.path}", "content_hash": file.content_hash, "size_bytes": file.size}
+            for file in stored
+        ]
+
+    def _schedule_variants(self, stored):
+        # Превью строятся в фоне; до их появления клиенты показывают оригинал
+        if stored and self.images is not None:
+            self.images.schedule([os.path.join(self.upload_dir, file.path) for file in stored])
+
     async def get_report(self, report_id: int, request=None) -> Optional[Report]:
         return await self.report_repository.get_report(report_id, request=request)
 
-    async def get_user_reports(self, user_id: int, request=None) -> List[Report]:
-        return await self.report_repository.get_user_reports(user_id, request=request)
+    async def get_user_reports(self, user_id: int, request=None, cursor: Optional[str] = None, limit: int = REPORTS_PAGE_DEFAULT,
+                               date_from: Optional[date] = None, date_to: Optional[date] = None):
+        reports = await self.report_repository.get_user_reports(
+            user_id, request=request, cursor=self._decode_cursor(cursor), limit=limit + 1,
+            date_from=date_from, date_to=date_to
+        )
+        return self._split_page(reports, limit)
+
+    async def get_challenge_reports(self, challenge_id: int, request=None, cursor: Optional[str] = None, limit: int = REPORTS_PAGE_DEFAULT,
+                                    date_from: Optional[date] = None, date_to: Optional[date] = None):
+        reports = await self.report_repository.get_challenge_reports(
+            challenge_id, request=request, cursor=self._decode_cursor(cursor), limit=limit + 1,
+            date_from=date_from, date_to=date_to
+        )
+        return self._split_page(reports, limit)
+
+    async def get_event_reports(self, event_id: int, cursor: Optional[str] = None, limit: int = REPORTS_PAGE_DEFAULT,
+                                date_from: Optional[date] = None, date_to: Optional[date] = None):
+        reports = await self.report_repository.get_event_reports(
+            event_id, cursor=self._decode_cursor(cursor), limit=limit + 1,
+            date_from=date_from, date_to=date_to
+        )
+        return self._split_page(reports, limit)
+
+    async def get_user_event_report(self, user_id: int, event_id: int) -> Optional[Report]:
+        return await self.report_repository.get_user_event_report(user_id, event_id)
+
+    async def get_report_days(self, user_id: int, challenge_id: int) -> Optional[ReportDays]:
+        found = await self.report_repository.get_report_dates(user_id, challenge_id)
+        if found is None:
+            return None
+        start_date, report_dates = found
+        start = start_date.date() if isinstance(start_date, datetime) else start_date
+        offsets = sorted({(d - start).days for d in report_dates})
+        return ReportDays(start_date=start, offsets=offsets)
 
-    async def get_challenge_reports(self, challenge_id: int, request=None) -> List[Report]:
-        return await self.report_repository.get_challenge_reports(challenge_id, request=request)
+    async def get_storage_by_challenge(self) -> List[ChallengeStorage]:
+        rows = await self.report_repository.get_storage_by_challenge()
+        return [ChallengeStorage.model_validate(row) for row in rows]
 
-    async def get_event_reports(self, event_id: int) -> List[Report]:
-        return await self.report_repository.get_event_reports(event_id)
+    @staticmethod
+    def _decode_cursor(cursor: Optional[str]):
+        return decode_cursor(cursor) if cursor else None
+
+    @staticmethod
+    def _split_page(reports, limit: int):
+        """Отрезает лишнюю запись и возвращает курсор следующей страницы, если она есть"""
+        if len(reports) <= limit:
+            return reports, None
+        page = reports[:limit]
+        return page, encode_cursor(page[-1].created_at, page[-1].id)
 
     async def delete_report(self, report_id: int) -> bool:
         # Получаем отчет
@@ -266,35 +390,9 @@ class ReportService:
         if report.rejected:
             return True
 
-        # Если отчет связан с челленджем, уменьшаем баллы участника
-        if report.challenge_id:
-            from .repository import ChallengeParticipantRepository, ChallengeRepository, EventRepository
-            participant_repo = ChallengeParticipantRepository(self.report_repository.db)
-            challenge_repo = ChallengeRepository(self.report_repository.db)
-            
-            participant = await participant_repo.get_participant(report.user_id, report.challenge_id)
-            if participant:
-                points_to_subtract = 0
-                
-                # Если отчет для мероприятия, используем очки мероприятия
-                if report.event_id:
-                    event_repo = EventRepository(self.report_repository.db)
-                    event = await event_repo.get_event(report.event_id)
-                    if event:
-                        points_to_subtract = event.points_per_report
-                else:
-                    # Если отчет для челленджа, используем очки челленджа
-                    challenge = await challenge_repo.get_challenge(report.challenge_id)
-                    if challenge:
-                        points_to_subtract = challenge.points_per_report
-                
-                # Снимаем очки
-                if points_to_subtract > 0:
-                    participant.points = max(0, participant.points - points_to_subtract)
-                    await self.report_repository.db.commit()
-
-        # Помечаем отчет как отклоненный
-        return await self.report_repository.reject_report(report_id)
+        # Помечаем отчет как отклоненный и снимаем баллы
+        await self._reject(report)
+        return True
 
     async def reject_report(self, report_id: int) -> Report:
         # Получаем отчет
@@ -306,35 +404,28 @@ class ReportService:
         if report.rejected:
             return report
         
-        # Отклоняем отчет в базе данных
-        await self.report_repository.reject_report(report_id)
-        
-        # Если отчет связан с челленджем, уменьшаем баллы участника
-        if report.challenge_id:
-            from .repository import ChallengeParticipantRepository, ChallengeRepository, EventRepository
-            participant_repo = ChallengeParticipantRepository(self.report_repository.db)
-            challenge_repo = ChallengeRepository(self.report_repository.db)
-            
-            participant = await participant_repo.get_participant(report.user_id, report.challenge_id)
-            if participant:
-                points_to_subtract = 0
-                
-                # Если отчет для мероприятия, используем очки мероприятия
-                if report.event_id:
-                    event_repo = EventRepository(self.report_repository.db)
-                    event = await event_repo.get_event(report.event_id)
-                    if event:
-                        points_to_subtract = event.points_per_report
-                else:
-                    # Если отчет для челленджа, используем очки челленджа
-                    challenge = await challenge_repo.get_challenge(report.challenge_id)
-                    if challenge:
-                        points_to_subtract = challenge.points_per_report
-                
-                # Снимаем очки
-                if points_to_subtract > 0:
-                    participant.points = max(0, participant.points - points_to_subtract)
-                    await self.report_repository.db.commit()
-        
-        # Возвращаем обновленный отчет
-        return await self.report_repository.get_report(report_id)
+        points = await self._reject(report)
+        return Report.model_validate(report).model_copy(update={"points": points})
+
+    async def _reject(self, report) -> Optional[int]:
+        """Отклоняет отчёт и в той же транзакции списывает начисленные за него баллы"""
+        db = self.report_repository.db
+        points = None
+        try:
+            report.rejected = True
+            report.rejected_at = datetime.utcnow()
+            # Если отчет связан с челленджем, уменьшаем баллы участника
+            if report.challenge_id:
+                participant_repo = ChallengeParticipantRepository(db)
+                points = await participant_repo.change_report_points(
+                    report.user_id, report.challenge_id, report.event_id, sign=-1
+                )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        recent_writes.mark(user_id=report.user_id)
+        if points is not None and self.leaderboard is not None:
+            self.leaderboard.set_points(report.challenge_id, report.user_id, points)
+        return points
@@ -0,0 +1,172 @@
+"""Раздача загруженных файлов с уменьшением изображений на лету.
+
+/uploads/<путь>?w=<ширина>&h=<высота> отдаёт копию, вписанную в заданный размер.
+Копии строятся в пуле процессов ImagePipeline и кэшируются на диске в пределах
+RESIZE_CACHE_BYTES с вытеснением давно не запрошенных.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import stat
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, QueryParams
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from .images import ImagePipeline, resize_image
+
+logger = logging.getLogger(__name__)
+
+RESIZE_CACHE_DIR = os.getenv("RESIZE_CACHE_DIR", "cache/resized")
+RESIZE_CACHE_BYTES = int(os.getenv("RESIZE_CACHE_BYTES", str(512 * 1024 * 1024)))
+RESIZE_MAX_DIMENSION = 2048
+RESIZE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+RESIZE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+RESIZE_EXTENSION = ".webp"
+
+
+class ResizeCache:
+    """Дисковый кэш уменьшенных копий с LRU-вытеснением по суммарному размеру"""
+
+    def __init__(self, directory: str = RESIZE_CACHE_DIR, max_bytes: int = RESIZE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+    def load(self):
+        """Восстанавливает порядок LRU по времени последнего доступа к файлам; вызывается при старте приложения"""
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(RESIZE_EXTENSION):
+                    continue
+                file_stat = os.stat(os.path.join(directory, filename))
+                files.append((file_stat.st_atime, filename[:-len(RESIZE_EXTENSION)], file_stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{RESIZE_EXTENSION}")
+
+    def get(self, key: str) -> Optional[str]:
+        if key not in self._entries:
+            return None
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return path
+
+    def discard(self, key: str):
+        self.size -= self._entries.pop(key, 0)
+
+    def add(self, key: str, size: int):
+        self.size += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._evict()
+
+    def _evict(self):
+        # Последнюю добавленную запись не вытесняем, даже если она одна больше бюджета
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+class ResizingStaticFiles(StaticFiles):
+    """StaticFiles, которые по параметрам w и h отдают уменьшенную копию изображения"""
+
+    def __init__(self, *args, images: ImagePipeline, cache: ResizeCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.images = images
+        self.cache = cache
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        params = QueryParams(scope["query_string"])
+        if "w" not in params and "h" not in params:
+            return await super().get_response(path, scope)
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        width, height = self._parse_size(params)
+
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        if not stat_result or not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404)
+        if os.path.splitext(full_path)[1].lower() not in RESIZE_EXTENSIONS:
+            raise HTTPException(status_code=400, detail="Resizing is supported for images only")
+
+        # Оригиналы неизменяемы (путь содержит sha256 содержимого), поэтому ключ —
+        # путь и запрошенный размер, ETag строгий, а копия кэшируется навсегда
+        key = hashlib.sha256(f"{os.path.normpath(path)}|{width}x{height}".encode()).hexdigest()
+        headers = {"etag": f'"{key}"', "cache-control": RESIZE_CACHE_CONTROL}
+        if self.is_not_modified(Headers(headers), Headers(scope=scope)):
+            return NotModifiedResponse(Headers(headers))
+
+        # Копия читается в память целиком (она небольшая): файл в кэше может быть
+        # вытеснен параллельным запросом в любой момент после get()
+        content = None
+        cached_path = self.cache.get(key)
+        if cached_path is not None:
+            try:
+                content = await anyio.to_thread.run_sync(_read_file, cached_path)
+            except FileNotFoundError:
+                self.cache.discard(key)
+        if content is None:
+            content = await self._render(key, full_path, width, height)
+        return Response(content, headers=headers, media_type="image/webp")
+
+    @staticmethod
+    def _parse_size(params: QueryParams) -> Tuple[Optional[int], Optional[int]]:
+        size = []
+        for name in ("w", "h"):
+            value = params.get(name)
+            if not value:
+                size.append(None)
+                continue
+            if not value.isdigit() or not 1 <= int(value) <= RESIZE_MAX_DIMENSION:
+                raise HTTPException(status_code=400, detail=f"'{name}' must be between 1 and {RESIZE_MAX_DIMENSION}")
+            size.append(int(value))
+        if size == [None, None]:
+            raise HTTPException(status_code=400, detail="'w' or 'h' is required")
+        return size[0], size[1]
+
+    async def _render(self, key: str, full_path: str, width: Optional[int], height: Optional[int]) -> bytes:
+        """Строит копию в пуле процессов; одновременные запросы одной копии ждут один результат"""
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._resize(key, full_path, width, height))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _resize(self, key: str, full_path: str, width: Optional[int], height: Optional[int]) -> bytes:
+        target = self.cache.path(key)
+        try:
+            size = await self.images.run(resize_image, full_path, target, width, height)
+        except Exception as e:
+            logger.warning(f"Failed to resize {full_path} to {width}x{height}: {e}")
+            raise HTTPException(status_code=422, detail="Failed to resize image")
+        # Читаем до добавления в кэш: до этого момента вытеснение файл не тронет
+        content = await anyio.to_thread.run_sync(_read_file, target)
+        self.cache.add(key, size)
+        return content
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
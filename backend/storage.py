@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import List, NamedTuple, Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+# Каталог, раздаваемый по /uploads; фото отчётов лежат в его подкаталоге reports
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Префикс photo_url относительно смонтированного каталога /uploads
+REPORT_URL_PREFIX = "reports/"
+REPORT_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "reports")
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+UPLOAD_MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_SIZE", str(20 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv("UPLOAD_MAX_REQUEST_SIZE", str(100 * 1024 * 1024)))
+
+DEFAULT_EXTENSION = ".jpg"
+# Временные файлы лежат внутри хранилища, чтобы rename был атомарным
+TMP_DIR = ".tmp"
+# Аренда файлов хеша на время между записью файла и коммитом строки report_photos
+LEASE_SUFFIX = ".lease"
+LEASE_SECONDS = 3600
+
+
+def lease_path(root: str, content_hash: str) -> str:
+    return os.path.join(root, TMP_DIR, f"{content_hash}{LEASE_SUFFIX}")
+
+
+def take_lease(root: str, content_hash: str):
+    """Отмечает, что файлы хеша используются загрузкой; отметка действует LEASE_SECONDS.
+
+    Сами файлы хранилища неизменяемы, их mtime не трогается.
+    """
+    path = lease_path(root, content_hash)
+    with open(path, "a"):
+        pass
+    os.utime(path)
+
+
+def has_lease(root: str, content_hash: str) -> bool:
+    try:
+        return os.stat(lease_path(root, content_hash)).st_mtime > time.time() - LEASE_SECONDS
+    except FileNotFoundError:
+        return False
+
+
+class UploadTooLarge(Exception):
+    """Файл или весь запрос превышает допустимый размер"""
+
+
+class _RequestBudget:
+    """Общий лимит байт на все файлы одного запроса"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def consume(self, size: int):
+        self.used += size
+        if self.used > self.max_bytes:
+            raise UploadTooLarge(f"Request exceeds {self.max_bytes} bytes")
+
+
+class StoredFile(NamedTuple):
+    content_hash: str
+    size: int
+    path: str  # относительно корня хранилища
+    created: bool  # False, если такой файл уже был в хранилище
+
+
+def content_path(content_hash: str, ext: str) -> str:
+    """Путь файла в хранилище: ab/cd/<sha256><ext>"""
+    return os.path.join(content_hash[:2], content_hash[2:4], f"{content_hash}{ext}")
+
+
+def file_extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not ext or len(ext) > 8 or not ext[1:].isalnum():
+        return DEFAULT_EXTENSION
+    return ".jpg" if ext == ".jpeg" else ext
+
+
+async def save_upload(upload: UploadFile, root: str, max_bytes: int = UPLOAD_MAX_FILE_SIZE,
+                      budget: _RequestBudget = None) -> StoredFile:
+    """Потоково пишет загруженный файл в хранилище с адресацией по содержимому.
+
+    Файл пишется кусками по UPLOAD_CHUNK_SIZE во временный файл с подсчётом
+    SHA-256 и затем переименовывается в ab/cd/<sha256><ext>. Если файл с таким
+    содержимым уже есть, временный файл удаляется и используется существующий.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"File {upload.filename} exceeds {max_bytes} bytes")
+    tmp_dir = os.path.join(root, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"File {upload.filename} exceeds {max_bytes} bytes")
+                if budget is not None:
+                    budget.consume(len(chunk))
+                digest.update(chunk)
+                await f.write(chunk)
+        content_hash = digest.hexdigest()
+        path = content_path(content_hash, file_extension(upload.filename))
+        full_path = os.path.join(root, path)
+        # Аренда берётся до проверки наличия файла: gc_uploads не удалит файл-сироту
+        # (и его уменьшенные копии), пока строка report_photos ещё не закоммичена
+        take_lease(root, content_hash)
+        if os.path.exists(full_path):
+            _remove_quietly(tmp_path)
+            return StoredFile(content_hash, written, path, created=False)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    return StoredFile(content_hash, written, path, created=True)
+
+
+async def save_uploads(uploads: List[UploadFile], root: str, max_file_bytes: int = UPLOAD_MAX_FILE_SIZE,
+                       max_request_bytes: int = UPLOAD_MAX_REQUEST_SIZE) -> List[StoredFile]:
+    """Параллельно сохраняет файлы одного запроса.
+
+    При любой ошибке созданные этим запросом файлы удаляются; файлы, которые
+    уже были в хранилище до запроса, не трогаются.
+    """
+    budget = _RequestBudget(max_request_bytes)
+    results = await asyncio.gather(
+        *(save_upload(upload, root, max_file_bytes, budget) for upload in uploads),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        discard_created(root, [result for result in results if isinstance(result, StoredFile)])
+        # Превышение лимита важнее прочих ошибок: клиенту нужно вернуть 413
+        too_large = [error for error in errors if isinstance(error, UploadTooLarge)]
+        raise (too_large or errors)[0]
+    return results
+
+
+def discard_created(root: str, files: List[StoredFile]):
+    """Удаляет файлы, созданные в хранилище этим запросом (например, при откате транзакции)"""
+    for file in files:
+        if file.created:
+            _remove_quietly(os.path.join(root, file.path))
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove {path}: {e}")
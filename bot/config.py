@@ -4,4 +4,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 TG_TOKEN = os.getenv('TG_TOKEN')
-BACKEND_URL = os.getenv('BACKEND_URL', 'http://backend:8000') 
\ No newline at end of file
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://backend:8000') 
+
+BACKEND_TIMEOUT = float(os.getenv('BACKEND_TIMEOUT', '10'))
+BACKEND_POOL_SIZE = int(os.getenv('BACKEND_POOL_SIZE', '100'))
+BACKEND_MAX_CONCURRENCY = int(os.getenv('BACKEND_MAX_CONCURRENCY', '50'))
+BACKEND_UPLOAD_TIMEOUT = float(os.getenv('BACKEND_UPLOAD_TIMEOUT', '60'))
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+
+PHOTO_DOWNLOAD_CONCURRENCY = int(os.getenv('PHOTO_DOWNLOAD_CONCURRENCY', '4'))
+PHOTO_DOWNLOAD_RETRIES = int(os.getenv('PHOTO_DOWNLOAD_RETRIES', '3'))
+PHOTO_MAX_SIZE = int(os.getenv('PHOTO_MAX_SIZE', str(20 * 1024 * 1024)))
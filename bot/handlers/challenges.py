@@ -1,12 +1,13 @@
 from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
-from services.challenges import get_actual_challenges, get_challenge, get_or_create_user, update_user_phone, is_joined, join_challenge, get_user_by_telegram_id, create_user, get_challenge_events, create_report, get_challenge_points, get_user_report_days, get_event, get_user_event_reports, get_challenge_leaderboard
+from services.challenges import get_actual_challenges, get_challenge, get_or_create_user, update_user_phone, is_joined, join_challenge, get_user_by_telegram_id, create_user, get_challenge_events, create_report, get_challenge_points, get_user_report_days, get_event, get_user_event_reports, get_challenge_leaderboard, get_challenge_view
 from utils.pagination import build_challenges_keyboard, build_events_keyboard, build_days_keyboard
 from utils.phone import validate_phone
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import logging
+import uuid
 
 router = Router()
 
@@ -36,7 +37,8 @@ async def safe_answer_or_edit(message_or_call, text: str, reply_markup=None, par
     else:  # Это Message
         await message_or_call.answer(text, reply_markup=reply_markup, parse_mode=parse_mode)
 
-async def send_challenge_card(message_or_call, challenge: dict, user: dict, joined: bool = None):
+async def send_challenge_card(message_or_call, challenge: dict, user: dict, joined: bool = None, points: int = None,
+                              rank: int = None, report_days: int = None):
     """Унифицированная функция для отправки карточки челленджа"""
     if joined is None:
         joined = await is_joined(user['id'], challenge['id'])
@@ -53,8 +55,13 @@ async def send_challenge_card(message_or_call, challenge: dict, user: dict, join
             types.InlineKeyboardButton(text="◀️ К списку челленджей", callback_data="to_challenges")
         ])
     else:
-        points = await get_challenge_points(user['id'], challenge_id)
+        if points is None:
+            points = await get_challenge_points(user['id'], challenge_id)
         text = f"🏆 <b>{challenge['title']}</b>\n\n📝 {challenge['description']}\n\n📅 <b>Период:</b> {challenge['start_date']} — {challenge['end_date']}\n\n⭐ <b>Ваши очки:</b> {points} 🏅"
+        if rank is not None:
+            text += f"\n📍 <b>Место в рейтинге:</b> {rank}"
+        if report_days is not None:
+            text += f"\n📋 <b>Отчётов отправлено:</b> {report_days}"
         buttons.extend([
             [
                 types.InlineKeyboardButton(text="🎯 Мероприятия", callback_data=f"events:{challenge_id}:0"),
@@ -88,7 +95,7 @@ async def start_handler(message: types.Message):
 
 @router.callback_query(lambda c: c.data == "to_challenges")
 async def to_challenges_callback(call: types.CallbackQuery):
-    challenges = await get_actual_challenges()
+    challenges, has_next = await get_actual_challenges(page=0, per_page=CHALLENGES_PER_PAGE)
     if not challenges:
         text = "🤷‍♂️ <b>Нет доступных челленджей</b>\n\n📅 На сегодня активных челленджей не найдено.\n\n🔄 Попробуйте позже!"
         kb = types.InlineKeyboardMarkup(
@@ -100,14 +107,14 @@ async def to_challenges_callback(call: types.CallbackQuery):
         await call.answer()
         return
     
-    kb = build_challenges_keyboard(challenges, page=0, per_page=CHALLENGES_PER_PAGE)
+    kb = build_challenges_keyboard(challenges, page=0, has_next=has_next)
     text = "🏆 <b>Доступные челленджи</b>\n\n🎯 Выберите челлендж для участия:"
     await safe_edit_message(call, text, kb)
     await call.answer()
 
 @router.message(Command('challenges'))
 async def challenges_handler(message: types.Message):
-    challenges = await get_actual_challenges()
+    challenges, has_next = await get_actual_challenges(page=0, per_page=CHALLENGES_PER_PAGE)
     if not challenges:
         text = "🤷‍♂️ <b>Нет доступных челленджей</b>\n\n📅 На сегодня активных челленджей не найдено.\n\n🔄 Попробуйте позже!"
         kb = types.InlineKeyboardMarkup(
@@ -118,15 +125,15 @@ async def challenges_handler(message: types.Message):
         await message.answer(text, reply_markup=kb, parse_mode='HTML')
         return
     
-    kb = build_challenges_keyboard(challenges, page=0, per_page=CHALLENGES_PER_PAGE)
+    kb = build_challenges_keyboard(challenges, page=0, has_next=has_next)
     text = "🏆 <b>Доступные челленджи</b>\n\n🎯 Выберите челлендж для участия:"
     await message.answer(text, reply_markup=kb, parse_mode='HTML')
 
 @router.callback_query(lambda c: c.data.startswith('ch_page:'))
 async def page_callback(call: CallbackQuery):
     page = int(call.data.split(':')[1])
-    challenges = await get_actual_challenges()
-    kb = build_challenges_keyboard(challenges, page=page, per_page=CHALLENGES_PER_PAGE)
+    challenges, has_next = await get_actual_challenges(page=page, per_page=CHALLENGES_PER_PAGE)
+    kb = build_challenges_keyboard(challenges, page=page, has_next=has_next)
     text = "🏆 <b>Доступные челленджи</b>\n\n🎯 Выберите челлендж для участия:"
     await safe_edit_message(call, text, kb)
     await call.answer()
@@ -134,18 +141,26 @@ async def page_callback(call: CallbackQuery):
 @router.callback_query(lambda c: c.data.startswith('challenge:'))
 async def challenge_detail_callback(call: CallbackQuery):
     challenge_id = int(call.data.split(':')[1])
-    challenge = await get_challenge(challenge_id)
-    user = await get_or_create_user(
-        telegram_id=call.from_user.id,
-        username=call.from_user.username
+    view = await get_challenge_view(challenge_id, call.from_user.id)
+    user = view['user']
+    if not user or user.get('username') != call.from_user.username:
+        # Новый пользователь или сменился username
+        user = await get_or_create_user(
+            telegram_id=call.from_user.id,
+            username=call.from_user.username
+        )
+    await send_challenge_card(
+        call, view['challenge'], user, view['joined'],
+        points=view['points'], rank=view['rank'], report_days=view['report_days']
     )
-    joined = await is_joined(user['id'], challenge_id)
-    await send_challenge_card(call, challenge, user, joined)
     await call.answer()
 
 @router.callback_query(lambda c: c.data.startswith('join:'))
 async def join_challenge_callback(call: CallbackQuery, state):
-    challenge_id = int(call.data.split(':')[1])
+    parts = call.data.split(':')
+    challenge_id = int(parts[1])
+    # Новая попытка получает свой ключ; кнопка «Попробовать снова» передаёт ключ неудавшейся попытки
+    join_key = parts[2] if len(parts) > 2 else uuid.uuid4().hex
     challenge = await get_challenge(challenge_id)
     user = await get_or_create_user(
         telegram_id=call.from_user.id,
@@ -163,12 +178,12 @@ async def join_challenge_callback(call: CallbackQuery, state):
         await safe_edit_message(call, text)
         await call.message.answer("📱 Поделитесь своим контактом:", reply_markup=kb)
         await state.set_state("awaiting_phone")
-        await state.update_data(user_id=user['id'], challenge_id=challenge_id)
+        await state.update_data(user_id=user['id'], challenge_id=challenge_id, join_key=join_key)
         await call.answer()
         return
     
     try:
-        await join_challenge(user['id'], challenge_id)
+        await join_challenge(user['id'], challenge_id, idempotency_key=join_key)
         success_text = f"🎉 <b>Поздравляем!</b>\n\n✅ Вы успешно присоединились к челленджу!\n\n🏆 <b>«{challenge['title']}»</b>\n\n🚀 Теперь вы можете участвовать в мероприятиях и отправлять отчёты!"
         
         # Показываем сообщение об успехе
@@ -190,7 +205,7 @@ async def join_challenge_callback(call: CallbackQuery, state):
         error_text = f"❌ <b>Ошибка присоединения</b>\n\n🔧 Не удалось присоединиться к челленджу.\n\n🔄 Попробуйте позже."
         kb = types.InlineKeyboardMarkup(
             inline_keyboard=[
-                [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data=f"join:{challenge_id}")],
+                [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data=f"join:{challenge_id}:{join_key}")],
                 [types.InlineKeyboardButton(text="◀️ К челленджу", callback_data=f"challenge:{challenge_id}")]
     ]
         )
@@ -210,17 +225,17 @@ async def phone_handler(message: types.Message, state):
     
     try:
         await update_user_phone(user_id, phone)
-        await join_challenge(user_id, challenge_id)
+        await join_challenge(user_id, challenge_id, idempotency_key=data.get('join_key'))
         await message.answer("✅ <b>Отлично!</b>\n\n📱 Номер телефона сохранен!\n🎉 Вы успешно присоединились к челленджу!", reply_markup=types.ReplyKeyboardRemove(), parse_mode='HTML')
         
-        challenges = await get_actual_challenges()
-        challenge = next((c for c in challenges if c['id'] == challenge_id), None)
+        challenge = await get_challenge(challenge_id)
         if not challenge:
             await message.answer('❌ Челлендж не найден', parse_mode='HTML')
-        return
+            await state.clear()
+            return
         
         user = {"id": user_id}  # Создаем объект пользователя для функции
-    # Отправляем карточку с кнопками и очками
+        # Отправляем карточку с кнопками и очками
         await send_challenge_card(message, challenge, user, joined=True)
         await state.clear()
         
@@ -326,7 +341,8 @@ async def report_day_callback(call: CallbackQuery, state: FSMContext):
     
     required_photos = challenge.get('required_photos', 1)
     await state.set_state(ReportPhotoFSM.waiting_photos)
-    await state.update_data(challenge_id=challenge_id, day=day, photos=[], required_photos=required_photos, call_message_id=call.message.message_id)
+    # Ключ идемпотентности отчёта: повторная отправка того же отчёта не создаёт его заново
+    await state.update_data(challenge_id=challenge_id, day=day, photos=[], required_photos=required_photos, call_message_id=call.message.message_id, report_key=str(uuid.uuid4()))
     
     text = f"📸 <b>Отправка отчёта</b>\n\n📅 <b>Дата:</b> {day}\n📋 <b>Челлендж:</b> {challenge['title']}\n\n📷 Пожалуйста, отправьте <b>{required_photos}</b> фото для отчёта."
     
@@ -425,13 +441,16 @@ async def handle_report_photos(message: types.Message, state: FSMContext):
             challenge_id=challenge_id,
             report_date=day,
             photos=photos,
-            bot=message.bot
+            bot=message.bot,
+            idempotency_key=data.get('report_key')
         )
         
         logger.info(f"Ответ от бэкенда на создание отчёта: {report}")
         if report and report.get('id'):
-            # Получаем и показываем баланс очков
-            points = await get_challenge_points(user['id'], challenge_id)
+            # Баланс очков приходит вместе с отчётом
+            points = report.get('points')
+            if points is None:
+                points = await get_challenge_points(user['id'], challenge_id)
             success_text = f"✅ <b>Отчёт успешно отправлен!</b>\n\n📅 <b>Дата:</b> {day}\n📷 <b>Фото:</b> {len(photos)}\n⭐ <b>Ваши очки:</b> {points} 🏅"
             kb = types.InlineKeyboardMarkup(
                 inline_keyboard=[
@@ -584,7 +603,7 @@ async def event_report_callback(call: CallbackQuery, state: FSMContext):
     
     required_photos = event.get('required_photos', 1)
     await state.set_state(EventReportPhotoFSM.waiting_photos)
-    await state.update_data(event_id=event_id, photos=[], required_photos=required_photos, call_message_id=call.message.message_id)
+    await state.update_data(event_id=event_id, photos=[], required_photos=required_photos, call_message_id=call.message.message_id, report_key=str(uuid.uuid4()))
     
     text = f"📸 <b>Отправка отчёта по мероприятию</b>\n\n🎯 <b>Мероприятие:</b> {event['title']}\n📅 <b>Дата:</b> {event['date']}\n⭐ <b>Баллы:</b> {event['points_per_report']} 🏅\n\n📷 Пожалуйста, отправьте <b>{required_photos}</b> фото для отчёта."
     
@@ -692,13 +711,16 @@ async def handle_event_report_photos(message: types.Message, state: FSMContext):
             event_id=event_id,
             report_date=event['date'],
             photos=photos,
-            bot=message.bot
+            bot=message.bot,
+            idempotency_key=data.get('report_key')
         )
         
         logger.info(f"Ответ от бэкенда на создание отчёта для мероприятия: {report}")
         if report and report.get('id'):
-            # Получаем и показываем баланс очков за челлендж
-            points = await get_challenge_points(user['id'], event['challenge_id'])
+            # Баланс очков за челлендж приходит вместе с отчётом
+            points = report.get('points')
+            if points is None:
+                points = await get_challenge_points(user['id'], event['challenge_id'])
             success_text = f"✅ <b>Отчёт успешно отправлен!</b>\n\n🎯 <b>Мероприятие:</b> {event['title']}\n📷 <b>Фото:</b> {len(photos)}\n⭐ <b>Ваши очки за челлендж:</b> {points} 🏅"
             kb = types.InlineKeyboardMarkup(
                 inline_keyboard=[
@@ -800,9 +822,9 @@ async def stats_callback(call: CallbackQuery):
             return
         
         # Получаем рейтинг участников
-        leaderboard = await get_challenge_leaderboard(challenge_id)
+        leaderboard = await get_challenge_leaderboard(challenge_id, user_id=user['id'], limit=10)
         
-        if not leaderboard:
+        if not leaderboard or not leaderboard['total']:
             text = f"📊 <b>Статистика челленджа</b>\n<b>«{challenge['title']}»</b>\n\n🤷‍♂️ В этом челлендже пока нет участников."
             kb = types.InlineKeyboardMarkup(
                 inline_keyboard=[
@@ -813,26 +835,23 @@ async def stats_callback(call: CallbackQuery):
             await call.answer()
             return
         
-        # Находим позицию текущего пользователя
-        user_position = None
-        user_points = None
-        for i, participant in enumerate(leaderboard, 1):
-            if participant['user_id'] == user['id']:
-                user_position = i
-                user_points = participant['points']
-                break
+        # Позиция текущего пользователя
+        me = leaderboard.get('me')
+        total = leaderboard['total']
         
         # Формируем текст с рейтингом
         text = f"📊 <b>Рейтинг участников</b>\n🏆 <b>«{challenge['title']}»</b>\n\n"
         
         # Показываем информацию о текущем пользователе
-        if user_position:
+        if me:
+            user_position = me['rank']
             position_emoji = "🥇" if user_position == 1 else "🥈" if user_position == 2 else "🥉" if user_position == 3 else "📍"
-            text += f"{position_emoji} <b>Ваша позиция: {user_position} место ({user_points} очков)</b>\n\n"
+            text += f"{position_emoji} <b>Ваша позиция: {user_position} место ({me['points']} очков)</b>\n\n"
         
         # Показываем топ-10
         text += "🏆 <b>Топ участников:</b>\n"
-        for i, participant in enumerate(leaderboard[:10], 1):  # Показываем топ-10
+        for participant in leaderboard['top']:
+            i = participant['rank']
             medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
             username = participant['username'] or "Аноним"
             points = participant['points']
@@ -843,10 +862,10 @@ async def stats_callback(call: CallbackQuery):
             else:
                 text += f"{medal} {username} — {points} очков\n"
         
-        if len(leaderboard) > 10:
-            text += f"\n... и ещё {len(leaderboard) - 10} участников"
+        if total > len(leaderboard['top']):
+            text += f"\n... и ещё {total - len(leaderboard['top'])} участников"
         
-        text += f"\n\n👥 <b>Всего участников:</b> {len(leaderboard)}"
+        text += f"\n\n👥 <b>Всего участников:</b> {total}"
         
         # Кнопки
         kb = types.InlineKeyboardMarkup(
@@ -1,8 +1,10 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from config import TG_TOKEN
+from config import TG_TOKEN, BACKEND_URL, BACKEND_TIMEOUT, BACKEND_POOL_SIZE, BACKEND_MAX_CONCURRENCY
 from handlers import challenges
+from services.backend import BackendClient, set_backend_client
+from services.challenges import user_cache
 
 # Настройка логирования
 logging.basicConfig(
@@ -12,8 +14,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 async def main():
+    backend_client = BackendClient(
+        BACKEND_URL,
+        timeout=BACKEND_TIMEOUT,
+        pool_size=BACKEND_POOL_SIZE,
+        max_concurrency=BACKEND_MAX_CONCURRENCY
+    )
     try:
         logger.info("Starting bot...")
+        await backend_client.start()
+        set_backend_client(backend_client)
+        
         bot = Bot(token=TG_TOKEN, parse_mode='HTML')
         dp = Dispatcher()
         
@@ -26,6 +37,9 @@ async def main():
     except Exception as e:
         logger.error(f"Error starting bot: {e}", exc_info=True)
         raise
+    finally:
+        logger.info(f"User cache stats: {user_cache.stats()}")
+        await backend_client.close()
 
 if __name__ == '__main__':
     try:
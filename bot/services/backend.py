@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class BackendClient:
+    """Долгоживущий HTTP-клиент бэкенда с пулом keep-alive соединений"""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 10,
+        pool_size: int = 100,
+        max_concurrency: int = 50,
+        keepalive_timeout: float = 30,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            logger.info(f"Backend client started: {self.base_url}, pool_size={self.pool_size}")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Backend client closed")
+        self._session = None
+
+    @asynccontextmanager
+    async def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs):
+        """Выполняет запрос к бэкенду, ограничивая число одновременных запросов"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        async with self._semaphore:
+            async with self._session.request(method, f'{self.base_url}{path}', **kwargs) as response:
+                yield response
+
+    def get(self, path: str, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path: str, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+
+_client: Optional[BackendClient] = None
+
+
+def set_backend_client(client: BackendClient):
+    global _client
+    _client = client
+
+
+def get_backend_client() -> BackendClient:
+    if _client is None:
+        raise RuntimeError("Backend client is not initialized")
+    return _client
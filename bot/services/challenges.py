@@ -1,106 +1,129 @@
 import aiohttp
-from datetime import date
-from config import BACKEND_URL
+from datetime import date, timedelta
+from config import BACKEND_UPLOAD_TIMEOUT, USER_CACHE_SIZE, USER_CACHE_TTL
+from services.backend import get_backend_client
+from services.cache import TTLCache
+from services.photos import download_photos
 import os
 from typing import List, Optional
 import io
 import logging
 
-async def get_actual_challenges():
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{BACKEND_URL}/challenges/') as response:
-            if response.status != 200:
-                raise Exception("Failed to get challenges")
-            challenges = await response.json()
-            today = date.today().isoformat()
-            return [
-                c for c in challenges
-                if c['start_date'] <= today <= c['end_date']
-            ]
+REPORTS_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# telegram_id -> пользователь бэкенда
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+async def get_actual_challenges(page: int = 0, per_page: int = 8):
+    """Возвращает страницу активных сегодня челленджей и признак наличия следующей"""
+    params = {"on": date.today().isoformat(), "limit": per_page + 1, "offset": page * per_page}
+    async with get_backend_client().get('/challenges/active', params=params) as response:
+        if response.status != 200:
+            raise Exception("Failed to get challenges")
+        challenges = await response.json()
+        return challenges[:per_page], len(challenges) > per_page
 
 async def get_challenge(challenge_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{BACKEND_URL}/challenges/{challenge_id}') as response:
-            if response.status != 200:
-                raise Exception("Failed to get challenge")
-            return await response.json()
+    async with get_backend_client().get(f'/challenges/{challenge_id}') as response:
+        if response.status != 200:
+            raise Exception("Failed to get challenge")
+        return await response.json()
+
+async def get_challenge_view(challenge_id, telegram_id):
+    """Челлендж, участие пользователя, очки, место и число отчётов одним запросом"""
+    params = {"challenge_id": challenge_id, "telegram_id": str(telegram_id)}
+    async with get_backend_client().get('/bot/challenge-view', params=params) as response:
+        if response.status != 200:
+            raise Exception("Failed to get challenge view")
+        view = await response.json()
+    if view.get('user'):
+        user_cache.set(view['user']['telegram_id'], view['user'])
+    return view
 
 async def get_user_by_telegram_id(telegram_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{BACKEND_URL}/users/by_telegram_id/{telegram_id}') as response:
-            if response.status == 200:
-                return await response.json()
-            return None
+    user = user_cache.get(str(telegram_id))
+    if user:
+        return user
+    async with get_backend_client().get(f'/users/by_telegram_id/{telegram_id}') as response:
+        if response.status == 200:
+            user = await response.json()
+            user_cache.set(user['telegram_id'], user)
+            return user
+        return None
 
 async def create_user(telegram_id, username=None, phone_number=None):
-    async with aiohttp.ClientSession() as session:
-        data = {"telegram_id": str(telegram_id), "username": username, "phone_number": phone_number}
-        async with session.post(f'{BACKEND_URL}/users/', json=data) as response:
-            if response.status != 200:
-                raise Exception("Failed to create user")
-            return await response.json()
+    data = {"telegram_id": str(telegram_id), "username": username, "phone_number": phone_number}
+    async with get_backend_client().post('/users/', json=data) as response:
+        if response.status != 200:
+            raise Exception("Failed to create user")
+        user = await response.json()
+        user_cache.set(user['telegram_id'], user)
+        return user
 
 async def get_or_create_user(telegram_id, username=None, phone_number=None):
-    user = await get_user_by_telegram_id(telegram_id)
-    if user:
+    """Получает пользователя или создаёт его одним запросом (upsert по telegram_id)"""
+    user = user_cache.get(str(telegram_id))
+    if user and (username is None or user.get('username') == username) and (phone_number is None or user.get('phone_number') == phone_number):
+        return user
+    data = {"telegram_id": str(telegram_id), "username": username, "phone_number": phone_number}
+    async with get_backend_client().post('/users/upsert', json=data) as response:
+        if response.status != 200:
+            raise Exception("Failed to get or create user")
+        user = await response.json()
+        user_cache.set(user['telegram_id'], user)
         return user
-    return await create_user(telegram_id, username, phone_number)
 
 async def update_user_phone(user_id, phone_number):
-    async with aiohttp.ClientSession() as session:
-        data = {"phone_number": phone_number}
-        async with session.patch(f'{BACKEND_URL}/users/{user_id}', json=data) as response:
-            if response.status != 200:
-                raise Exception("Failed to update user phone")
-            return await response.json()
+    data = {"phone_number": phone_number}
+    async with get_backend_client().patch(f'/users/{user_id}', json=data) as response:
+        if response.status != 200:
+            raise Exception("Failed to update user phone")
+        user = await response.json()
+        if user:
+            user_cache.set(user['telegram_id'], user)
+        return user
 
 async def is_joined(user_id, challenge_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{BACKEND_URL}/challenges/{challenge_id}/is_joined', params={"user_id": user_id}) as response:
-            if response.status != 200:
-                raise Exception("Failed to check join status")
-            data = await response.json()
-            return data.get("joined", False)
-
-async def join_challenge(user_id, challenge_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f'{BACKEND_URL}/challenges/{challenge_id}/join', params={"user_id": user_id}) as response:
-            if response.status != 200:
-                raise Exception("Failed to join challenge")
-            return await response.json()
+    async with get_backend_client().get(f'/challenges/{challenge_id}/is_joined', params={"user_id": user_id}) as response:
+        if response.status != 200:
+            raise Exception("Failed to check join status")
+        data = await response.json()
+        return data.get("joined", False)
+
+async def join_challenge(user_id, challenge_id, idempotency_key: Optional[str] = None):
+    """idempotency_key — ключ попытки вступления: повтор той же попытки не дублирует участие"""
+    headers = {IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+    async with get_backend_client().post(f'/challenges/{challenge_id}/join', params={"user_id": user_id}, headers=headers) as response:
+        if response.status != 200:
+            raise Exception("Failed to join challenge")
+        return await response.json()
 
 async def get_challenge_events(challenge_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{BACKEND_URL}/challenges/{challenge_id}/events') as response:
-            if response.status != 200:
-                raise Exception("Failed to get events")
-            return await response.json()
+    async with get_backend_client().get(f'/challenges/{challenge_id}/events') as response:
+        if response.status != 200:
+            raise Exception("Failed to get events")
+        return await response.json()
 
 async def get_event(event_id):
     """Получает конкретное мероприятие по ID"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f'{BACKEND_URL}/events/{event_id}') as response:
-            if response.status != 200:
-                return None
-            return await response.json()
+    async with get_backend_client().get(f'/events/{event_id}') as response:
+        if response.status != 200:
+            return None
+        return await response.json()
 
 async def get_user_event_reports(user_id: int, event_id: int) -> List[dict]:
     """Получает отчеты пользователя для конкретного мероприятия"""
     logger = logging.getLogger(__name__)
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BACKEND_URL}/reports/event/{event_id}") as response:
-            if response.status != 200:
-                logger.warning(f"Failed to get event reports: status {response.status}")
-                return []
-            all_reports = await response.json()
-            logger.info(f"Got {len(all_reports)} reports for event {event_id}")
-            
-            # Фильтруем по user_id
-            user_reports = [r for r in all_reports if r.get('user_id') == user_id]
-            logger.info(f"User {user_id} has {len(user_reports)} reports for event {event_id}")
-            
-            return user_reports
+
+    async with get_backend_client().get(f"/reports/event/{event_id}/user/{user_id}") as response:
+        if response.status == 404:
+            return []
+        if response.status != 200:
+            logger.warning(f"Failed to get user event report: status {response.status}")
+            return []
+        return [await response.json()]
 
 async def create_report(
     user_id: int,
@@ -109,23 +132,49 @@ async def create_report(
     event_id: Optional[int] = None,
     report_date: str = None,
     photos: List[str] = None,
-    bot=None
+    bot=None,
+    idempotency_key: Optional[str] = None
 ) -> dict:
-    """Создает отчет с фотографиями"""
+    """Создает отчет с фотографиями одним запросом"""
     logger = logging.getLogger(__name__)
-    
-    async with aiohttp.ClientSession() as session:
-        # Сначала создаем отчет
-        report_data = {
-            "user_id": user_id,
-            "text_content": text_content,
-            "challenge_id": challenge_id,
-            "event_id": event_id,
-            "report_date": report_date
-        }
-        logger.info(f"Creating report: {report_data}")
-        
-        async with session.post(f"{BACKEND_URL}/reports", json=report_data) as response:
+
+    report_data = {
+        "user_id": user_id,
+        "text_content": text_content,
+        "challenge_id": challenge_id,
+        "event_id": event_id,
+        "report_date": report_date
+    }
+    logger.info(f"Creating report: {report_data}")
+
+    # Скачиваем фото параллельно во временные файлы
+    downloaded = await download_photos(bot, photos) if photos and bot else []
+    if photos and len(downloaded) < len(photos):
+        for _, photo_file in downloaded:
+            photo_file.close()
+        raise Exception(f"Failed to download photos: got {len(downloaded)} of {len(photos)}")
+
+    try:
+        # Поля отчёта и файлы уходят одним multipart-запросом; файлы читаются при отправке по частям
+        data = aiohttp.FormData()
+        for name, value in report_data.items():
+            if value is not None:
+                data.add_field(name, str(value))
+        for i, (photo_id, photo_file) in enumerate(downloaded):
+            data.add_field(
+                'photos',
+                photo_file,
+                filename=f"photo_{i}_{photo_id}.jpg",
+                content_type='image/jpeg'
+            )
+
+        headers = {IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+        async with get_backend_client().post(
+            "/reports/submit",
+            data=data,
+            headers=headers,
+            timeout=BACKEND_UPLOAD_TIMEOUT
+        ) as response:
             if response.status == 409:
                 error_text = await response.text()
                 logger.warning(f"Report conflict (409): {error_text}")
@@ -134,93 +183,60 @@ async def create_report(
                 error_text = await response.text()
                 logger.error(f"Failed to create report (status {response.status}): {error_text}")
                 raise Exception(f"Failed to create report: {response.status} {error_text}")
-            
+
             report = await response.json()
-            logger.info(f"Report created successfully: {report['id']}")
-            
-            # Затем загружаем фотографии
-            if photos and bot:
-                logger.info(f"Uploading {len(photos)} photos for report {report['id']}")
-                
-                # Создаём FormData со всеми фотографиями
-                data = aiohttp.FormData()
-                
-                # Скачиваем все фото и добавляем в FormData
-                for i, photo_id in enumerate(photos):
-                    # Скачиваем файл через aiogram
-                    photo_bytes = await bot.download(photo_id)
-                    photo_bytes.seek(0)
-                    
-                    # Добавляем каждое фото в FormData
-                    data.add_field(
-                        'photos',
-                        photo_bytes,
-                        filename=f"photo_{i}_{photo_id}.jpg",
-                        content_type='image/jpeg'
-                    )
-                
-                # Отправляем все фото одним запросом
-                async with session.post(
-                    f"{BACKEND_URL}/reports/{report['id']}/photos",
-                    data=data
-                ) as photo_response:
-                    if photo_response.status != 200:
-                        error_text = await photo_response.text()
-                        logger.warning(f"Failed to upload photos: {photo_response.status} - {error_text}")
-                    else:
-                        logger.info(f"All {len(photos)} photos uploaded successfully")
-                        
-            return report
-
-async def get_user_reports(user_id: int) -> List[dict]:
-    """Получает все отчеты пользователя"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BACKEND_URL}/reports/user/{user_id}") as response:
-            if response.status != 200:
-                return []
-            return await response.json()
-
-async def get_challenge_reports(challenge_id: int) -> List[dict]:
-    """Получает все отчеты по челленджу"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BACKEND_URL}/reports/challenge/{challenge_id}") as response:
-            if response.status != 200:
-                return []
-            return await response.json()
+            logger.info(f"Report {report['id']} created with {len(report.get('photos', []))} photos")
+    finally:
+        for _, photo_file in downloaded:
+            photo_file.close()
+
+    return report
+
+async def get_report_page(path: str, cursor: Optional[str] = None, limit: int = REPORTS_PAGE_SIZE, **filters):
+    """Получает страницу отчетов и курсор следующей страницы"""
+    params = {"limit": limit, **filters}
+    if cursor:
+        params["cursor"] = cursor
+    async with get_backend_client().get(path, params=params) as response:
+        if response.status != 200:
+            return [], None
+        return await response.json(), response.headers.get(NEXT_CURSOR_HEADER)
+
+async def get_user_reports(user_id: int, cursor: Optional[str] = None, limit: int = REPORTS_PAGE_SIZE):
+    """Получает страницу отчетов пользователя"""
+    return await get_report_page(f"/reports/user/{user_id}", cursor=cursor, limit=limit)
+
+async def get_challenge_reports(challenge_id: int, cursor: Optional[str] = None, limit: int = REPORTS_PAGE_SIZE):
+    """Получает страницу отчетов по челленджу"""
+    return await get_report_page(f"/reports/challenge/{challenge_id}", cursor=cursor, limit=limit)
 
 async def get_challenge_points(user_id: int, challenge_id: int) -> int:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BACKEND_URL}/challenges/{challenge_id}/participants/{user_id}/points") as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get("points", 0)
-            return 0
+    async with get_backend_client().get(f"/challenges/{challenge_id}/participants/{user_id}/points") as response:
+        if response.status == 200:
+            data = await response.json()
+            return data.get("points", 0)
+        return 0
 
 async def get_user_report_days(user_id: int, challenge_id: int) -> list:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BACKEND_URL}/reports/user/{user_id}") as response:
-            if response.status != 200:
-                return []
-            reports = await response.json()
-            # Фильтруем по challenge_id и собираем даты из report_date
-            days = set()
-            for r in reports:
-                if r.get("challenge_id") == challenge_id and not r.get("event_id"):  # Только отчеты челленджа, не мероприятий
-                    # Используем report_date вместо created_at
-                    report_date = r.get("report_date")
-                    if report_date:
-                        days.add(report_date)
-            return list(days)
-
-async def get_challenge_leaderboard(challenge_id: int) -> List[dict]:
-    """Получает рейтинг участников челленджа"""
+    """Даты (YYYY-MM-DD), за которые пользователь уже отправил отчёт по челленджу"""
+    async with get_backend_client().get(f"/reports/user/{user_id}/challenge/{challenge_id}/days") as response:
+        if response.status != 200:
+            return []
+        data = await response.json()
+    start = date.fromisoformat(data["start_date"])
+    return [(start + timedelta(days=offset)).isoformat() for offset in data["offsets"]]
+
+async def get_challenge_leaderboard(challenge_id: int, user_id: Optional[int] = None, limit: int = 10) -> Optional[dict]:
+    """Получает топ участников челленджа, позицию пользователя и общее число участников"""
     logger = logging.getLogger(__name__)
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{BACKEND_URL}/challenges/{challenge_id}/leaderboard") as response:
-            if response.status != 200:
-                logger.warning(f"Failed to get leaderboard: status {response.status}")
-                return []
-            leaderboard = await response.json()
-            logger.info(f"Got leaderboard for challenge {challenge_id}: {len(leaderboard)} participants")
-            return leaderboard 
\ No newline at end of file
+
+    params = {"limit": limit}
+    if user_id is not None:
+        params["user_id"] = user_id
+    async with get_backend_client().get(f"/challenges/{challenge_id}/leaderboard", params=params) as response:
+        if response.status != 200:
+            logger.warning(f"Failed to get leaderboard: status {response.status}")
+            return None
+        leaderboard = await response.json()
+        logger.info(f"Got leaderboard for challenge {challenge_id}: {leaderboard['total']} participants")
+        return leaderboard
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+import tempfile
+from typing import BinaryIO, List, Optional, Tuple
+
+from config import PHOTO_DOWNLOAD_CONCURRENCY, PHOTO_DOWNLOAD_RETRIES, PHOTO_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Файлы до этого размера остаются в памяти, крупнее — сбрасываются на диск
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+async def _download_photo(bot, photo_id: str, semaphore: asyncio.Semaphore) -> Optional[BinaryIO]:
+    """Скачивает одно фото во временный файл с повторными попытками"""
+    for attempt in range(1, PHOTO_DOWNLOAD_RETRIES + 1):
+        async with semaphore:
+            destination = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+            try:
+                file = await bot.get_file(photo_id)
+                if file.file_size and file.file_size > PHOTO_MAX_SIZE:
+                    logger.warning(f"Photo {photo_id} is too large: {file.file_size} bytes")
+                    destination.close()
+                    return None
+                await bot.download_file(file.file_path, destination=destination)
+                return destination
+            except Exception as e:
+                destination.close()
+                logger.warning(f"Failed to download photo {photo_id} (attempt {attempt}/{PHOTO_DOWNLOAD_RETRIES}): {e}")
+        if attempt < PHOTO_DOWNLOAD_RETRIES:
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+    return None
+
+
+async def download_photos(bot, photo_ids: List[str]) -> List[Tuple[str, BinaryIO]]:
+    """Параллельно скачивает фото из Telegram.
+
+    Возвращает пары (photo_id, файл) в исходном порядке; фото, которые не удалось
+    скачать или которые превышают PHOTO_MAX_SIZE, пропускаются. Файлы закрывает вызывающий.
+    """
+    semaphore = asyncio.Semaphore(PHOTO_DOWNLOAD_CONCURRENCY)
+    files = await asyncio.gather(*(_download_photo(bot, photo_id, semaphore) for photo_id in photo_ids))
+    return [(photo_id, file) for photo_id, file in zip(photo_ids, files) if file is not None]
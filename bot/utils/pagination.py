@@ -2,11 +2,8 @@ from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta
 
-def build_challenges_keyboard(challenges, page=0, per_page=8):
+def build_challenges_keyboard(page_challenges, page=0, has_next=False):
     builder = InlineKeyboardBuilder()
-    start = page * per_page
-    end = start + per_page
-    page_challenges = challenges[start:end]
     for c in page_challenges:
         builder.row(
             InlineKeyboardButton(
@@ -17,7 +14,7 @@ def build_challenges_keyboard(challenges, page=0, per_page=8):
     nav_buttons = []
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text='⬅️', callback_data=f'ch_page:{page-1}'))
-    if end < len(challenges):
+    if has_next:
         nav_buttons.append(InlineKeyboardButton(text='➡️', callback_data=f'ch_page:{page+1}'))
     if nav_buttons:
         builder.row(*nav_buttons)
@@ -15,6 +15,7 @@ interface ReportsModalProps {
 
 const ReportsModal = ({ isOpen, onClose, challengeId }: ReportsModalProps) => {
     const [reports, setReports] = useState<Report[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [selectedUser, setSelectedUser] = useState<number | null>(null);
     const [loadingReports, setLoadingReports] = useState<number[]>([]);
     const { getChallengeReports, loading, error, rejectReport } = useChallenges();
@@ -27,20 +28,35 @@ const ReportsModal = ({ isOpen, onClose, challengeId }: ReportsModalProps) => {
 
     const fetchReports = async () => {
         try {
-            const data = await getChallengeReports(challengeId);
-            setReports(data);
+            const page = await getChallengeReports(challengeId);
+            setReports(page.items);
+            setNextCursor(page.nextCursor);
         } catch (err) {
             message.error('Ошибка при загрузке отчетов');
             setReports([]);
+            setNextCursor(null);
+        }
+    };
+
+    // Следующая страница подгружается по запросу модератора
+    const loadMoreReports = async () => {
+        if (!nextCursor) return;
+        try {
+            const page = await getChallengeReports(challengeId, nextCursor);
+            setReports(prev => [...prev, ...page.items]);
+            setNextCursor(page.nextCursor);
+        } catch (err) {
+            message.error('Ошибка при загрузке отчетов');
         }
     };
 
     const handleRejectReport = async (reportId: number) => {
         try {
             setLoadingReports(prev => [...prev, reportId]);
-            await rejectReport(reportId);
+            const updated: Report = await rejectReport(reportId);
             message.success('Отчет успешно отклонен, баллы сняты');
-            await fetchReports(); // Обновляем список отчетов после отклонения
+            // Обновляем отчет на месте, чтобы не сбрасывать уже загруженные страницы
+            setReports(prev => prev.map(report => report.id === reportId ? { ...report, ...updated } : report));
         } catch (err) {
             console.error('Error rejecting report:', err);
             message.error('Ошибка при отклонении отчета');
@@ -106,16 +122,22 @@ const ReportsModal = ({ isOpen, onClose, challengeId }: ReportsModalProps) => {
                         gap: '8px',
                         maxWidth: 300
                     }}>
-                        {photos.map((photo, index) => (
-                            <Image
-                                key={index}
-                                width={60}
-                                height={60}
-                                style={{ objectFit: 'cover' }}
-                                src={`${import.meta.env.VITE_API_URL}/uploads/${photo.photo_url}`}
-                                alt={`Фото ${index + 1}`}
-                            />
-                        ))}
+                        {photos.map((photo, index) => {
+                            const original = `${import.meta.env.VITE_API_URL}/uploads/${photo.photo_url}`;
+                            const thumb = photo.variants?.thumb;
+                            return (
+                                <Image
+                                    key={index}
+                                    width={60}
+                                    height={60}
+                                    style={{ objectFit: 'cover' }}
+                                    src={thumb ? `${import.meta.env.VITE_API_URL}/uploads/${thumb}` : original}
+                                    fallback={original}
+                                    preview={{ src: original }}
+                                    alt={`Фото ${index + 1}`}
+                                />
+                            );
+                        })}
                     </div>
                 </Image.PreviewGroup>
             )
@@ -199,6 +221,13 @@ const ReportsModal = ({ isOpen, onClose, challengeId }: ReportsModalProps) => {
                 pagination={{ pageSize: 5 }}
                 scroll={{ x: 1120 }}
             />
+            {nextCursor && (
+                <div style={{ textAlign: 'center', marginTop: 16 }}>
+                    <Button onClick={loadMoreReports} loading={loading}>
+                        Загрузить еще
+                    </Button>
+                </div>
+            )}
         </Modal>
     );
 };
@@ -1,7 +1,8 @@
 import { useState } from 'react';
-import type { Challenge, Event, Report } from '../types';
+import type { Challenge, Event, ReportPage } from '../types';
 
 const VITE_API_URL = 'https://libertylib.online/api'
+const REPORTS_PAGE_SIZE = 50;
 
 export const useChallenges = () => {
     const [loading, setLoading] = useState(false);
@@ -100,17 +101,25 @@ export const useChallenges = () => {
         if (!response.ok) throw new Error('Ошибка при удалении мероприятия');
     });
 
-    const getChallengeReports = (challengeId: number) => handleRequest(async () => {
-        const response = await fetch(`${VITE_API_URL}/reports/challenge/${challengeId}`);
-        if (!response.ok) throw new Error('Ошибка при получении отчетов');
-        return response.json();
-    });
+    // Списки отчетов отдаются страницами, курсор следующей страницы приходит в заголовке
+    const fetchReportPage = async (path: string, errorMessage: string, cursor?: string | null): Promise<ReportPage> => {
+        const params = new URLSearchParams({ limit: String(REPORTS_PAGE_SIZE) });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`${VITE_API_URL}${path}?${params}`);
+        if (!response.ok) throw new Error(errorMessage);
+        return {
+            items: await response.json(),
+            nextCursor: response.headers.get('X-Next-Cursor'),
+        };
+    };
 
-    const getUserReports = (userId: number) => handleRequest(async () => {
-        const response = await fetch(`${VITE_API_URL}/reports/user/${userId}`);
-        if (!response.ok) throw new Error('Ошибка при получении отчетов пользователя');
-        return response.json();
-    });
+    const getChallengeReports = (challengeId: number, cursor?: string | null) => handleRequest(() =>
+        fetchReportPage(`/reports/challenge/${challengeId}`, 'Ошибка при получении отчетов', cursor)
+    );
+
+    const getUserReports = (userId: number, cursor?: string | null) => handleRequest(() =>
+        fetchReportPage(`/reports/user/${userId}`, 'Ошибка при получении отчетов пользователя', cursor)
+    );
 
     const rejectReport = async (reportId: number) => {
         setLoading(true);
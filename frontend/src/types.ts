@@ -31,6 +31,7 @@ export interface ReportPhoto {
     report_id: number;
     photo_url: string;
     created_at: string;
+    variants: Record<string, string>;
 }
 
 export interface Report {
@@ -44,4 +45,8 @@ export interface Report {
     rejected_at: string | null;
     user: User;
     photos: ReportPhoto[];
-} 
\ No newline at end of file
+} 
+export interface ReportPage {
+    items: Report[];
+    nextCursor: string | null;
+}